@@ -1,12 +1,47 @@
+import argparse
 import asyncio
 
-from bot import run_bot
+from config import BOT_MODE, NICHE_ENV_FILES, WORKER_PROCESSES, load_niches
 from storage import init_db
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Lead bot")
+    parser.add_argument(
+        "--mode",
+        choices=("polling", "webhook"),
+        default=BOT_MODE,
+        help="how to receive Telegram updates (default: BOT_MODE or polling)",
+    )
+    parser.add_argument(
+        "--niches",
+        nargs="+",
+        default=NICHE_ENV_FILES,
+        metavar="ENV_FILE",
+        help="env files of the niches served by this process (default: NICHE_ENV_FILES or ENV_FILE)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKER_PROCESSES,
+        help="worker processes to spread updates over by chat (default: WORKER_PROCESSES or 0, no workers)",
+    )
+    args = parser.parse_args()
+
     init_db()
-    asyncio.run(run_bot())
+    niches = load_niches(args.niches)
+    if args.workers > 0:
+        from sharding import run_sharded
+
+        asyncio.run(run_sharded(niches, args.mode, args.workers))
+    elif args.mode == "webhook":
+        from webhook_server import run_webhook
+
+        asyncio.run(run_webhook(niches))
+    else:
+        from bot import run_bot
+
+        asyncio.run(run_bot(niches))
 
 
 if __name__ == "__main__":
@@ -1,8 +1,157 @@
+"""Logging that does not block the caller: records go through a bounded in-memory queue to
+a listener thread, which formats and writes them. When the queue is full, records are
+dropped instead of waiting.
+
+Warnings and errors repeated from the same place (or with the same ``rate_key`` extra, e.g.
+one failing CRM webhook) pass LOG_ERROR_BURST at once and then LOG_ERROR_RATE per second.
+Past that, one in LOG_SAMPLE_EVERY still gets through with a count of what was suppressed.
+
+With LOG_FORMAT=json every record is a JSON line and carries the ``lead_id``, ``user_id``
+and ``handler`` set with log_context() (or passed as extras).
+"""
+
+from __future__ import annotations
+
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Hashable, Iterator
+
+import metrics
+from config import LOG_ERROR_BURST, LOG_ERROR_RATE, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLE_EVERY
+from ratelimit import KeyedTokenBuckets
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+CONTEXT_FIELDS = ("lead_id", "user_id", "handler")
+
+DROPPED = metrics.Counter("log_records_dropped_total", "Log records not written", ("reason",))
+
+_context: contextvars.ContextVar[dict[str, Any]] = contextvars.ContextVar("log_context", default={})
+_listener: logging.handlers.QueueListener | None = None
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """Attach ``fields`` to every record logged inside the block (and tasks it starts)."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind_log_context(**fields: Any) -> None:
+    """Attach ``fields`` to the records logged from here to the end of the current context."""
+    _context.set({**_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for field, value in _context.get().items():
+            if not hasattr(record, field):
+                setattr(record, field, value)
+        return True
+
+
+class RepeatFilter(logging.Filter):
+    """Rate-limits and samples WARNING and above per call site or ``rate_key``; passing
+    records get ``suppressed``, the count of similar ones dropped since the last one."""
+
+    def __init__(self, rate: float, burst: float, sample_every: int, max_keys: int = 1000) -> None:
+        super().__init__()
+        self.buckets = KeyedTokenBuckets(rate, burst, max_keys=max_keys)
+        self.sample_every = max(1, sample_every)
+        self.max_keys = max_keys
+        self._suppressed: OrderedDict[Hashable, int] = OrderedDict()
+        # Records arrive from the event loop and from worker threads alike.
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        key = getattr(record, "rate_key", None) or (record.pathname, record.lineno)
+        with self._lock:
+            suppressed = self._suppressed.pop(key, 0)
+            if not self.buckets.get(key).try_take() and (suppressed + 1) % self.sample_every:
+                self._suppressed[key] = suppressed + 1
+                while len(self._suppressed) > self.max_keys:
+                    self._suppressed.popitem(last=False)
+                DROPPED.inc("repeated")
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Freeze the message now, while its arguments still hold their current values, but
+        # leave the traceback to be formatted by the listener thread.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc("queue_full")
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} ({suppressed} similar suppressed)" if suppressed else text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
 
 
 def setup_logging() -> None:
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-    )
+    global _listener
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter(TEXT_FORMAT))
+    records: queue.Queue[logging.LogRecord] = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(records)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(RepeatFilter(LOG_ERROR_RATE, LOG_ERROR_BURST, LOG_SAMPLE_EVERY))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    _listener = logging.handlers.QueueListener(records, stream)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write out what is queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,130 @@
+"""Monthly archive files for old leads: ``leads-YYYY-MM.db`` in one directory, by the
+month the lead was created in (UTC, like ``created_at``).
+
+Archived rows keep the typed columns of ``leads``. Of the raw payload only the fields
+the columns do not already hold are kept, as zlib-compressed JSON in ``payload_diff``;
+lead_payload() puts the original back together. A lead whose user comes back is moved
+out of its archive file again (storage.save_lead).
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import zlib
+from datetime import date
+from pathlib import Path
+from typing import Any, Iterable, Mapping, Sequence
+
+LEAD_COLUMNS = (
+    "id",
+    "niche",
+    "created_at",
+    "updated_at",
+    "name",
+    "phone",
+    "email",
+    "budget_key",
+    "budget_label",
+    "region",
+    "timeframe_key",
+    "timeframe_label",
+    "contacted_before",
+    "status",
+    "duplicate_count",
+)
+
+_SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS leads (
+        id INTEGER PRIMARY KEY,
+        {", ".join(column + " TEXT" for column in LEAD_COLUMNS[1:-1])},
+        duplicate_count INTEGER,
+        payload_diff BLOB
+    );
+    CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads (created_at);
+"""
+
+
+def archive_path(directory: Path, month: str) -> Path:
+    return directory / f"leads-{month}.db"
+
+
+def archive_files(directory: Path, start: date | None, end: date | None) -> list[Path]:
+    """Existing archive files of the months from start to end (inclusive), oldest first."""
+    if not directory.is_dir():
+        return []
+    first = f"{start:%Y-%m}" if start else "0000-00"
+    last = f"{end:%Y-%m}" if end else "9999-99"
+    return [
+        path
+        for path in sorted(directory.glob("leads-????-??.db"))
+        if first <= path.stem.removeprefix("leads-") <= last
+    ]
+
+
+def encode_payload(row: Mapping[str, Any]) -> bytes | None:
+    payload = json.loads(row["raw_payload"] or "{}")
+    extra = {key: value for key, value in payload.items() if key not in LEAD_COLUMNS or row[key] != value}
+    if not extra:
+        return None
+    return zlib.compress(json.dumps(extra, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def lead_payload(row: Mapping[str, Any]) -> dict[str, Any]:
+    """The raw payload of an archived lead, as it was stored in ``leads``."""
+    payload = {column: row[column] for column in LEAD_COLUMNS if column != "id"}
+    if row["payload_diff"]:
+        payload.update(json.loads(zlib.decompress(row["payload_diff"])))
+    return payload
+
+
+def read_lead(directory: Path, month: str, lead_id: int) -> sqlite3.Row | None:
+    path = archive_path(directory, month)
+    if not path.exists():
+        return None
+    conn = sqlite3.connect(path)
+    try:
+        conn.row_factory = sqlite3.Row
+        return conn.execute("SELECT * FROM leads WHERE id=?", (lead_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def update_files(directory: Path, month: str | None, statement: str, params: Sequence[Any]) -> None:
+    """Run ``statement`` in the archive file of ``month``, or in every archive file when
+    ``month`` is None. Months without a file are skipped."""
+    if month is None:
+        paths = archive_files(directory, None, None)
+    else:
+        paths = [path for path in [archive_path(directory, month)] if path.exists()]
+    for path in paths:
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                conn.execute(statement, params)
+        finally:
+            conn.close()
+
+
+def write_leads(directory: Path, rows: Iterable[Mapping[str, Any]]) -> None:
+    """Store ``leads`` rows in their month's archive file. Rows already archived are
+    replaced, so an interrupted run can simply be repeated."""
+    by_month: dict[str, list[tuple[Any, ...]]] = {}
+    for row in rows:
+        values = (*(row[column] for column in LEAD_COLUMNS), encode_payload(row))
+        by_month.setdefault(row["created_at"][:7], []).append(values)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    placeholders = ",".join("?" * (len(LEAD_COLUMNS) + 1))
+    for month, values in by_month.items():
+        conn = sqlite3.connect(archive_path(directory, month))
+        try:
+            conn.executescript(_SCHEMA)
+            with conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO leads ({', '.join(LEAD_COLUMNS)}, payload_diff) "
+                    f"VALUES ({placeholders})",
+                    values,
+                )
+        finally:
+            conn.close()
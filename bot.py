@@ -1,47 +1,50 @@
 import asyncio
 import logging
+import time
 from datetime import datetime, date, timedelta
 from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable
 
-from aiogram import Bot, Dispatcher, F, Router
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
 from aiogram.enums import ParseMode
-from aiogram.filters import Command, CommandStart
+from aiogram.filters import Command, CommandStart, Filter
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
 from aiogram.types import (
     CallbackQuery,
     Message,
-    InlineKeyboardButton,
-    InlineKeyboardMarkup,
-    KeyboardButton,
-    ReplyKeyboardMarkup,
-    ReplyKeyboardRemove,
     FSInputFile,
+    TelegramObject,
 )
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from app_logging import setup_logging
+from app_logging import bind_log_context, log_context, setup_logging
 from config import (
-    ADMIN_IDS,
-    ASK_EMAIL,
-    BOT_TOKEN,
-    NICHE_NAME,
-    INTRO_TEXT,
-    QUESTION_NAME,
-    QUESTION_PHONE,
-    QUESTION_EMAIL,
-    QUESTION_BUDGET,
-    QUESTION_REGION,
-    QUESTION_TIMEFRAME,
-    QUESTION_CONTACTED,
-    THANK_YOU_MESSAGE,
-    DUPLICATE_MESSAGE,
-    PHONE_MIN_DIGITS,
-    REGION_OPTIONS,
-    TIMEFRAME_OPTIONS,
-    BUDGET_OPTIONS,
-    NOTIFY_ON_DUPLICATE,
+    NicheSettings,
+    load_niches,
+    EXPORT_COMPRESSION,
+    FSM_STORAGE,
+    FSM_TTL_SECONDS,
+    FSM_CACHE_SIZE,
+    FSM_FLUSH_SECONDS,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_MAX_RETRIES,
+    METRICS_HOST,
+    METRICS_PORT,
+    PULL_API_HOST,
+    PULL_API_PORT,
+    FLOOD_RATE,
+    FLOOD_BURST,
+    FLOOD_DEBOUNCE_SECONDS,
+    FLOOD_MAX_USERS,
+    FLOOD_LOG_EVERY,
 )
 from logic import (
     get_budget_option,
@@ -50,114 +53,149 @@ from logic import (
     status_label,
     format_lead_message,
 )
-from states import LeadForm
-from storage import init_db, save_lead, stats as lead_stats, export_leads_csv, push_to_integrations
+import csv_sink
+import funnel
+import lead_index
+import metrics
+import outbox
+import pull_api
+import send_scheduler
+from form import (
+    CompiledForm,
+    CompiledStep,
+    INVALID_CHOICE,
+    REMOVE_KEYBOARD,
+    START_KEYBOARD,
+    compile_form,
+)
+from flood_control import FloodControlMiddleware
+from fsm_storage import SQLiteStorage
+from send_scheduler import Priority, SendScheduler, send_priority
+from storage import (
+    init_db,
+    find_lead,
+    save_lead,
+    stats as lead_stats,
+    STATS_DIMENSIONS,
+    export_leads_csv,
+    start_http_client,
+    close_http_client,
+    close_engine,
+)
 
 router = Router()
 
 
-def is_admin(user_id: int | None) -> bool:
-    return bool(user_id) and user_id in ADMIN_IDS
-
-
-def normalize_phone(text: str) -> str | None:
-    if not text:
-        return None
-    digits = "".join(ch for ch in text if ch.isdigit())
-    if len(digits) < PHONE_MIN_DIGITS:
-        return None
-    return digits
-
-
-def is_valid_email(text: str) -> bool:
-    if not text or "@" not in text:
-        return False
-    local, _, domain = text.partition("@")
-    return bool(local.strip()) and "." in domain
-
-
-def build_start_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="Начать", callback_data="lead_start")]]
-    )
-
-
-def build_budget_keyboard() -> InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-    for option in BUDGET_OPTIONS:
-        builder.button(text=option["label"], callback_data=f"budget:{option['key']}")
-    builder.adjust(1)
-    return builder.as_markup()
-
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Times every handler of the router, and lead form steps separately by step name."""
 
-def build_timeframe_keyboard() -> InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-    for option in TIMEFRAME_OPTIONS:
-        builder.button(text=option["label"], callback_data=f"timeframe:{option['key']}")
-    builder.adjust(1)
-    return builder.as_markup()
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.HANDLER_SECONDS.observe(elapsed, name)
+            step = data.get("step")
+            if step is not None:
+                metrics.FORM_STEP_SECONDS.observe(elapsed, step.spec.name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Times Bot API requests; registered after SendScheduler, so queueing is excluded."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as exc:
+            metrics.TELEGRAM_API_ERRORS.inc(name, type(exc).__name__)
+            raise
+        finally:
+            metrics.TELEGRAM_API_SECONDS.observe(time.perf_counter() - started, name)
 
 
-def build_yes_no_keyboard(prefix: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="Да", callback_data=f"{prefix}:yes"),
-                InlineKeyboardButton(text="Нет", callback_data=f"{prefix}:no"),
-            ]
-        ]
-    )
+class LogContextMiddleware(BaseMiddleware):
+    """Tags what is logged while a handler runs with the user and the handler name."""
 
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        with log_context(user_id=user.id if user else None, handler=data["handler"].callback.__name__):
+            return await handler(event, data)
 
-def build_region_keyboard() -> InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-    for region in REGION_OPTIONS:
-        builder.button(text=region, callback_data=f"region:{region}")
-    builder.adjust(1)
-    return builder.as_markup()
 
+_handler_metrics = HandlerMetricsMiddleware()
+_log_context = LogContextMiddleware()
+for _observer in (router.message, router.callback_query):
+    _observer.middleware(_log_context)
+    _observer.middleware(_handler_metrics)
 
-def build_contact_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="Поделиться контактом", request_contact=True)]],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
 
+class NicheMiddleware(BaseMiddleware):
+    """Passes the settings of the niche whose bot received the update as ``niche``,
+    and its compiled lead form as ``form``."""
 
-async def ask_budget(message: Message, state: FSMContext) -> None:
-    await state.set_state(LeadForm.budget)
-    await message.answer(QUESTION_BUDGET, reply_markup=build_budget_keyboard())
+    def __init__(self, niches: dict[int, NicheSettings]) -> None:
+        self.niches = niches
+        self.forms = {bot_id: compile_form(niche) for bot_id, niche in niches.items()}
 
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        bot_id = data["bot"].id
+        data["niche"] = self.niches[bot_id]
+        data["form"] = self.forms[bot_id]
+        return await handler(event, data)
 
-async def ask_region(message: Message, state: FSMContext) -> None:
-    await state.set_state(LeadForm.region)
-    if REGION_OPTIONS:
-        await message.answer(QUESTION_REGION, reply_markup=build_region_keyboard())
-        return
-    await message.answer(QUESTION_REGION)
 
+class FormStepFilter(Filter):
+    """Matches while the user is inside the lead form and passes the current step as ``step``."""
 
-async def ask_timeframe(message: Message, state: FSMContext) -> None:
-    await state.set_state(LeadForm.timeframe)
-    await message.answer(QUESTION_TIMEFRAME, reply_markup=build_timeframe_keyboard())
+    async def __call__(
+        self, event: TelegramObject, raw_state: str | None, form: CompiledForm
+    ) -> bool | dict[str, Any]:
+        step = form.by_state.get(raw_state) if raw_state else None
+        return {"step": step} if step else False
 
 
-async def ask_contacted(message: Message, state: FSMContext) -> None:
-    await state.set_state(LeadForm.contacted)
-    await message.answer(QUESTION_CONTACTED, reply_markup=build_yes_no_keyboard("contacted"))
+def is_admin(niche: NicheSettings, user_id: int | None) -> bool:
+    return bool(user_id) and user_id in niche.admin_ids
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext) -> None:
+async def cmd_start(message: Message, state: FSMContext, niche: NicheSettings) -> None:
     await state.clear()
-    await message.answer(INTRO_TEXT, reply_markup=build_start_keyboard())
+    await message.answer(niche.intro_text, reply_markup=START_KEYBOARD)
 
 
 @router.callback_query(F.data == "lead_start")
-async def lead_start(callback: CallbackQuery, state: FSMContext) -> None:
-    await state.set_state(LeadForm.name)
-    await callback.message.answer(QUESTION_NAME)
+async def lead_start(
+    callback: CallbackQuery, state: FSMContext, niche: NicheSettings, form: CompiledForm
+) -> None:
+    await ask_step(callback.message, state, niche, form.first)
     await callback.answer()
 
 
@@ -167,143 +205,60 @@ async def cmd_cancel(message: Message, state: FSMContext) -> None:
     await message.answer("Ок, отменил. Чтобы начать заново, отправьте /start.")
 
 
-@router.message(LeadForm.name)
-async def lead_name(message: Message, state: FSMContext) -> None:
-    name = (message.text or "").strip()
-    if not name:
-        await message.answer("Пожалуйста, напишите ваше имя.")
-        return
-    await state.update_data(name=name)
-    await state.set_state(LeadForm.phone)
-    await message.answer(
-        QUESTION_PHONE,
-        reply_markup=build_contact_keyboard(),
-    )
-
-
-@router.message(LeadForm.phone)
-async def lead_phone(message: Message, state: FSMContext) -> None:
-    phone_raw = ""
-    if message.contact:
-        phone_raw = message.contact.phone_number or ""
-    else:
-        phone_raw = message.text or ""
-
-    phone = normalize_phone(phone_raw)
-    if not phone:
-        await message.answer(
-            f"Не удалось распознать номер. Введите телефон в формате +7XXXXXXXXXX (мин. {PHONE_MIN_DIGITS} цифр)."
-        )
-        return
-
-    await state.update_data(phone=phone)
-    await message.answer("Спасибо!", reply_markup=ReplyKeyboardRemove())
-
-    if ASK_EMAIL:
-        await state.set_state(LeadForm.email)
-        skip_keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text="Пропустить", callback_data="skip_email")]]
-        )
-        await message.answer(QUESTION_EMAIL, reply_markup=skip_keyboard)
-        return
-
-    await ask_budget(message, state)
-
-
-@router.callback_query(LeadForm.email, F.data == "skip_email")
-async def lead_email_skip(callback: CallbackQuery, state: FSMContext) -> None:
-    await state.update_data(email=None)
-    await callback.answer()
-    await ask_budget(callback.message, state)
-
-
-@router.message(LeadForm.email)
-async def lead_email(message: Message, state: FSMContext) -> None:
-    text = (message.text or "").strip()
-    if text.lower() in {"пропустить", "skip", "нет"}:
-        await state.update_data(email=None)
-        await ask_budget(message, state)
-        return
-
-    if not is_valid_email(text):
-        await message.answer("Похоже на некорректный email. Попробуйте ещё раз или нажмите «Пропустить».")
-        return
-
-    await state.update_data(email=text)
-    await ask_budget(message, state)
-
-
-@router.callback_query(LeadForm.budget, F.data.startswith("budget:"))
-async def lead_budget(callback: CallbackQuery, state: FSMContext) -> None:
-    budget_key = callback.data.split(":", 1)[1]
-    option = get_budget_option(budget_key)
-    if not option:
-        await callback.answer("Выберите вариант из списка.")
-        return
-
-    await state.update_data(budget_key=budget_key, budget_label=option["label"])
-    await callback.answer()
-    await ask_region(callback.message, state)
-
-
-@router.callback_query(LeadForm.region, F.data.startswith("region:"))
-async def lead_region_choice(callback: CallbackQuery, state: FSMContext) -> None:
-    region = callback.data.split(":", 1)[1]
-    await state.update_data(region=region)
-    await callback.answer()
-    await ask_timeframe(callback.message, state)
-
-
-@router.message(LeadForm.region)
-async def lead_region(message: Message, state: FSMContext) -> None:
-    region = (message.text or "").strip()
-    if not region:
-        await message.answer("Пожалуйста, укажите регион.")
+@router.message(Command("stats"))
+async def cmd_stats(message: Message, niche: NicheSettings) -> None:
+    if not is_admin(niche, message.from_user.id if message.from_user else None):
+        await message.answer("Нет доступа.")
         return
-    await state.update_data(region=region)
-    await ask_timeframe(message, state)
 
+    usage = "Формат: /stats [YYYY-MM-DD YYYY-MM-DD] [day|budget|timeframe|region]"
+    parts = (message.text or "").split()[1:]
+    dimension = None
+    if parts and parts[-1] in STATS_DIMENSIONS:
+        dimension = parts.pop()
 
-@router.callback_query(LeadForm.timeframe, F.data.startswith("timeframe:"))
-async def lead_timeframe(callback: CallbackQuery, state: FSMContext) -> None:
-    timeframe_key = callback.data.split(":", 1)[1]
-    option = get_timeframe_option(timeframe_key)
-    if not option:
-        await callback.answer("Выберите вариант из списка.")
+    start = end = None
+    if len(parts) == 2:
+        start = parse_date(parts[0])
+        end = parse_date(parts[1])
+        if not start or not end:
+            await message.answer(usage)
+            return
+    elif parts:
+        await message.answer(usage)
         return
 
-    await state.update_data(timeframe_key=timeframe_key, timeframe_label=option["label"])
-    await callback.answer()
-    await ask_contacted(callback.message, state)
-
-
-@router.callback_query(LeadForm.contacted, F.data.startswith("contacted:"))
-async def lead_contacted(callback: CallbackQuery, state: FSMContext) -> None:
-    value = callback.data.split(":", 1)[1]
-    contacted_label = "Да" if value == "yes" else "Нет"
-    await state.update_data(contacted_before=value, contacted_before_label=contacted_label)
-    await callback.answer()
-    await finalize_lead(callback.message, state)
-
-
-@router.message(Command("stats"))
-async def cmd_stats(message: Message) -> None:
-    if not is_admin(message.from_user.id if message.from_user else None):
-        await message.answer("Нет доступа.")
-        return
-    data = lead_stats()
-    await message.answer(
-        "Статистика лидов:\n"
-        f"Всего: {data['total']}\n"
-        f"Горячих: {data['hot']}\n"
-        f"Тёплых: {data['warm']}\n"
-        f"Холодных: {data['cold']}"
-    )
+    data = await lead_stats(niche.niche_id, start, end, dimension)
+    lines = [
+        "Статистика лидов:" if not start else f"Статистика лидов за {start.isoformat()} – {end.isoformat()}:",
+        f"Всего: {data['total']}",
+        f"Горячих: {data['hot']}",
+        f"Тёплых: {data['warm']}",
+        f"Холодных: {data['cold']}",
+    ]
+    if dimension:
+        lines.append("")
+        for value, bucket in data["breakdown"].items():
+            lines.append(
+                f"{stats_value_label(niche, dimension, value)}: {bucket['total']} "
+                f"(гор. {bucket['hot']}, тёпл. {bucket['warm']}, хол. {bucket['cold']})"
+            )
+    await message.answer("\n".join(lines))
+
+
+def stats_value_label(niche: NicheSettings, dimension: str, value: str) -> str:
+    if dimension == "budget":
+        option = get_budget_option(niche, value)
+        return option["label"] if option else (value or "-")
+    if dimension == "timeframe":
+        option = get_timeframe_option(niche, value)
+        return option["label"] if option else (value or "-")
+    return value or "-"
 
 
 @router.message(Command("export"))
-async def cmd_export(message: Message) -> None:
-    if not is_admin(message.from_user.id if message.from_user else None):
+async def cmd_export(message: Message, niche: NicheSettings) -> None:
+    if not is_admin(niche, message.from_user.id if message.from_user else None):
         await message.answer("Нет доступа.")
         return
 
@@ -325,10 +280,138 @@ async def cmd_export(message: Message) -> None:
         start = end - timedelta(days=30)
 
     filename = f"leads_{start.isoformat()}_{end.isoformat()}.csv"
-    export_path = Path("/tmp") / filename
-    export_leads_csv(start, end, export_path)
+    if EXPORT_COMPRESSION == "gzip":
+        filename += ".gz"
+    elif EXPORT_COMPRESSION == "zip":
+        filename += ".zip"
+    # Bots of different niches may export the same range at the same time.
+    export_path = Path("/tmp") / f"{message.bot.id}_{filename}"
+    await export_leads_csv(niche.niche_id, start, end, export_path, EXPORT_COMPRESSION)
+
+    await message.answer_document(FSInputFile(export_path, filename=filename))
+
+
+@router.message(Command("funnel"))
+async def cmd_funnel(message: Message, niche: NicheSettings, form: CompiledForm) -> None:
+    if not is_admin(niche, message.from_user.id if message.from_user else None):
+        await message.answer("Нет доступа.")
+        return
+
+    parts = (message.text or "").split()[1:]
+    start = end = None
+    if len(parts) == 2:
+        start = parse_date(parts[0])
+        end = parse_date(parts[1])
+    if parts and (len(parts) != 2 or not start or not end):
+        await message.answer("Формат: /funnel [YYYY-MM-DD YYYY-MM-DD]")
+        return
+
+    rows = await funnel.report(niche.niche_id, list(form.steps), start, end)
+    lines = ["Воронка анкеты:" if not start else f"Воронка анкеты за {start.isoformat()} – {end.isoformat()}:"]
+    for row in rows:
+        line = f"{row['step']}: показан {row['shown']}, ответили {row['answered']}"
+        if row["shown"]:
+            line += f" ({row['answered'] * 100 // row['shown']}%)"
+        if row["invalid"]:
+            line += f", ошибок ввода {row['invalid']}"
+        lines.append(line)
+    started = rows[0]["shown"] if rows else 0
+    completed = sum(row["completed"] for row in rows)
+    lines.append("")
+    lines.append(f"Заявок: {completed}" + (f" ({completed * 100 // started}% от начавших)" if started else ""))
+    await message.answer("\n".join(lines))
+
+
+# The form handlers come after the commands, so /stats and /export work mid-form.
+@router.message(FormStepFilter())
+async def form_message(
+    message: Message, state: FSMContext, niche: NicheSettings, form: CompiledForm, step: CompiledStep
+) -> None:
+    if not step.accepts_text:
+        return
+    if message.contact and step.spec.kind == "phone":
+        text = message.contact.phone_number or ""
+    else:
+        text = message.text or ""
+    answer = step.parse_text(text)
+    if answer is None:
+        funnel.record(niche.niche_id, message.chat.id, step.spec.name, funnel.Event.INVALID)
+        await message.answer(step.spec.error)
+        return
+    await advance_form(message, state, niche, form, step, answer)
+
+
+@router.callback_query(FormStepFilter())
+async def form_callback(
+    callback: CallbackQuery, state: FSMContext, niche: NicheSettings, form: CompiledForm, step: CompiledStep
+) -> None:
+    answer = step.parse_callback(callback.data or "")
+    if answer is None:
+        funnel.record(niche.niche_id, callback.from_user.id, step.spec.name, funnel.Event.INVALID)
+        await callback.answer(INVALID_CHOICE)
+        return
+    await callback.answer()
+    await advance_form(callback.message, state, niche, form, step, answer)
+
+
+async def ask_step(message: Message, state: FSMContext, niche: NicheSettings, step: CompiledStep) -> None:
+    await state.set_state(step.state)
+    funnel.record(niche.niche_id, message.chat.id, step.spec.name, funnel.Event.SHOWN)
+    await message.answer(step.spec.question, reply_markup=step.markup)
+
+
+async def advance_form(
+    message: Message,
+    state: FSMContext,
+    niche: NicheSettings,
+    form: CompiledForm,
+    step: CompiledStep,
+    answer: dict,
+) -> None:
+    data = await state.update_data(**answer)
+    funnel.record(niche.niche_id, message.chat.id, step.spec.name, funnel.Event.ANSWERED)
+    if step.spec.kind == "phone":
+        await message.answer("Спасибо!", reply_markup=REMOVE_KEYBOARD)
+
+    if "update_of" in data:
+        pending = [name for name in data["update_pending"] if name != step.spec.name]
+        await state.update_data(update_pending=pending)
+        next_step = pending[0] if pending else None
+    elif (existing := await find_returning_lead(niche, step, answer)) is not None:
+        # Keep what was answered in this dialog, take the rest from the stored lead and
+        # ask only the update steps that are still unanswered.
+        pending = [name for name in form.update_steps if form.steps[name].spec.answer_field not in data]
+        prefill = {field: existing.get(field) for field in form.fields if field not in data}
+        await state.update_data(**prefill, update_of=existing["id"], update_pending=pending)
+        await message.answer(niche.returning_message)
+        next_step = pending[0] if pending else None
+    else:
+        next_step = step.next_step_for(answer)
+    if next_step is None:
+        await finalize_lead(message, state, niche, form)
+        funnel.record(niche.niche_id, message.chat.id, step.spec.name, funnel.Event.COMPLETED)
+        return
+    await ask_step(message, state, niche, form.steps[next_step])
 
-    await message.answer_document(FSInputFile(export_path))
+
+async def find_returning_lead(niche: NicheSettings, step: CompiledStep, answer: dict) -> dict | None:
+    """The stored lead of a user recognised by the phone (or email) just given, if any."""
+    value = answer.get(step.spec.answer_field)
+    if not value:
+        return None
+    if step.spec.kind == "phone" and lead_index.known_phone(niche.niche_id, value):
+        lead = await find_lead(niche.niche_id, phone=value)
+        match = "phone"
+    elif step.spec.kind == "email" and niche.duplicate_check_email and lead_index.known_email(
+        niche.niche_id, value
+    ):
+        lead = await find_lead(niche.niche_id, email=value)
+        match = "email"
+    else:
+        return None
+    if lead is not None:
+        metrics.RETURNING_USERS.inc(niche.niche_id, match)
+    return lead
 
 
 def parse_date(value: str) -> date | None:
@@ -338,12 +421,14 @@ def parse_date(value: str) -> date | None:
         return None
 
 
-async def finalize_lead(message: Message, state: FSMContext) -> None:
+async def finalize_lead(
+    message: Message, state: FSMContext, niche: NicheSettings, form: CompiledForm
+) -> None:
     data = await state.get_data()
 
     budget_key = data.get("budget_key")
     timeframe_key = data.get("timeframe_key")
-    status = segment_lead(budget_key, timeframe_key)
+    status = segment_lead(niche, budget_key, timeframe_key)
 
     lead = {
         "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -359,45 +444,159 @@ async def finalize_lead(message: Message, state: FSMContext) -> None:
         "contacted_before_label": data.get("contacted_before_label"),
         "status": status,
     }
+    # Answers to questions added to the form later; they end up in the raw payload.
+    for field in form.fields:
+        lead.setdefault(field, data.get(field))
 
-    lead_id, is_duplicate = save_lead(lead)
+    # Integrations are queued in the same transaction and delivered by the outbox dispatcher.
+    lead_id, is_duplicate = await save_lead(niche, lead, update_of=data.get("update_of"))
     lead["id"] = lead_id
-
+    bind_log_context(lead_id=lead_id)
+    lead_index.add(niche.niche_id, lead["phone"], lead["email"])
     if not is_duplicate:
-        await push_to_integrations(lead)
-        await notify_admins(message.bot, lead)
-    elif NOTIFY_ON_DUPLICATE:
-        await notify_admins(message.bot, lead)
+        outbox.wake()
 
     await state.clear()
+    if not is_duplicate:
+        await message.answer(niche.thank_you_message)
+    else:
+        await message.answer(niche.updated_message if "update_of" in data else niche.duplicate_message)
 
-    if is_duplicate:
-        await message.answer(DUPLICATE_MESSAGE)
-        return
+    if not is_duplicate or niche.notify_on_duplicate:
+        await notify_admins(message.bot, niche, lead)
+
+
+# Admin notifications in flight across all leads. The send scheduler releases at most
+# TELEGRAM_GLOBAL_RATE messages a second; more than that would only wait in its queue.
+_notify_slots = asyncio.Semaphore(max(1, int(TELEGRAM_GLOBAL_RATE)))
 
-    await message.answer(THANK_YOU_MESSAGE)
 
+async def _notify_admin(bot: Bot, admin_id: int, text: str) -> None:
+    async with _notify_slots:
+        await bot.send_message(admin_id, text)
 
-async def notify_admins(bot: Bot, lead: dict) -> None:
-    if not ADMIN_IDS:
+
+async def notify_admins(bot: Bot, niche: NicheSettings, lead: dict) -> None:
+    if not niche.admin_ids:
         return
     text = format_lead_message(lead)
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, text)
-        except Exception:
-            logging.exception("Failed to notify admin %s", admin_id)
+    admin_ids = list(niche.admin_ids)
+    # The send scheduler paces these behind interactive replies and retries them on 429.
+    with send_priority(Priority.NOTIFICATION):
+        results = await asyncio.gather(
+            *(_notify_admin(bot, admin_id, text) for admin_id in admin_ids),
+            return_exceptions=True,
+        )
+    for admin_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            logging.error("Failed to notify admin %s", admin_id, exc_info=result)
+
+
+def build_fsm_storage() -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    return SQLiteStorage(
+        ttl_seconds=FSM_TTL_SECONDS,
+        cache_size=FSM_CACHE_SIZE,
+        flush_seconds=FSM_FLUSH_SECONDS,
+    )
 
 
-async def run_bot() -> None:
+async def start_delivery(niches: Iterable[NicheSettings]) -> None:
+    """Integration delivery and the pull API; a sharded run keeps them in the main process."""
+    start_http_client()
+    outbox.start(niches)
+    if PULL_API_PORT:
+        await pull_api.start_http_server(PULL_API_HOST, PULL_API_PORT)
+
+
+async def stop_delivery() -> None:
+    await pull_api.stop_http_server()
+    await outbox.stop()
+    await csv_sink.close_all()
+    await close_http_client()
+
+
+async def on_startup(niches: dict[int, NicheSettings], shard: int | None = None) -> None:
+    """``shard`` is the index of this worker process in a sharded run (see sharding.py)."""
+    await lead_index.load(niche.niche_id for niche in niches.values())
+    if shard is None:
+        await start_delivery(niches.values())
+    funnel.start()
+    if METRICS_PORT:
+        # Each worker process has its own counters, exposed on the ports after METRICS_PORT.
+        port = METRICS_PORT if shard is None else METRICS_PORT + 1 + shard
+        await metrics.start_http_server(METRICS_HOST, port)
+
+
+async def on_shutdown(shard: int | None = None) -> None:
+    await metrics.stop_http_server()
+    await send_scheduler.close_all()
+    if shard is None:
+        await stop_delivery()
+    await funnel.stop()
+    close_engine()
+
+
+def create_bot(
+    niche: NicheSettings,
+    session: BaseSession | None = None,
+    global_rate: float = TELEGRAM_GLOBAL_RATE,
+) -> Bot:
+    if not niche.bot_token:
+        raise RuntimeError(f"BOT_TOKEN is required (niche {niche.niche_id})")
+    bot = Bot(
+        token=niche.bot_token,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    bot.session.middleware(
+        SendScheduler(
+            global_rate=global_rate,
+            chat_rate=TELEGRAM_CHAT_RATE,
+            chat_burst=TELEGRAM_CHAT_BURST,
+            max_retries=TELEGRAM_MAX_RETRIES,
+        )
+    )
+    bot.session.middleware(ApiMetricsMiddleware())
+    return bot
+
+
+def create_dispatcher(niches: dict[int, NicheSettings], shard: int | None = None) -> Dispatcher:
+    """One dispatcher serves every niche; ``niches`` maps a bot id to its settings."""
+    dp = Dispatcher(storage=build_fsm_storage(), niches=niches, shard=shard)
+    dp.update.outer_middleware(
+        FloodControlMiddleware(
+            rate=FLOOD_RATE,
+            burst=FLOOD_BURST,
+            debounce_seconds=FLOOD_DEBOUNCE_SECONDS,
+            max_users=FLOOD_MAX_USERS,
+            log_every=FLOOD_LOG_EVERY,
+        )
+    )
+    dp.update.outer_middleware(NicheMiddleware(niches))
+    dp.include_router(router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+def create_bots(niches: list[NicheSettings]) -> tuple[list[Bot], Dispatcher]:
+    bots = [create_bot(niche) for niche in niches]
+    dp = create_dispatcher({bot.id: niche for bot, niche in zip(bots, niches)})
+    return bots, dp
+
+
+async def run_bot(niches: list[NicheSettings] | None = None) -> None:
     setup_logging()
     init_db()
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.include_router(router)
+    bots, dp = create_bots(niches or load_niches())
 
-    logging.info("Lead bot started")
-    await dp.start_polling(bot)
+    # getUpdates is rejected while a webhook is registered, e.g. after running in webhook mode.
+    for bot in bots:
+        await bot.delete_webhook()
+    logging.info("Lead bot started (long polling, %s niche(s))", len(bots))
+    await dp.start_polling(*bots)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+"""Admin commands for cron and shell use: ``python -m cli <command> --help``.
+
+Only the modules a command needs are imported, and never aiogram, so commands start
+quickly and work without BOT_TOKEN.
+"""
+
+import argparse
+import json
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+
+def _niche_id(value: str | None) -> str | None:
+    # Resolved only when a command runs: "all" covers every niche, no value means ENV_FILE's.
+    if value == "all":
+        return None
+    if value:
+        return value
+    from config import NICHE
+
+    return NICHE.niche_id
+
+
+def cmd_stats(args: argparse.Namespace) -> None:
+    import queries
+
+    # Straight from the file when its schema is current; otherwise storage migrates it first.
+    conn = queries.open_current()
+    if conn is not None:
+        try:
+            data = queries.stats(conn, _niche_id(args.niche), args.start, args.end, args.by)
+        finally:
+            conn.close()
+    else:
+        import asyncio
+
+        from storage import close_engine, init_db, stats
+
+        init_db()
+        try:
+            data = asyncio.run(stats(_niche_id(args.niche), args.start, args.end, args.by))
+        finally:
+            close_engine()
+
+    if args.json:
+        json.dump(data, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+    print(f"total {data['total']}  hot {data['hot']}  warm {data['warm']}  cold {data['cold']}")
+    for value, bucket in data.get("breakdown", {}).items():
+        print(f"{value or '-'}\t{bucket['total']}\t{bucket['hot']}\t{bucket['warm']}\t{bucket['cold']}")
+
+
+def cmd_export(args: argparse.Namespace) -> None:
+    import asyncio
+
+    from config import EXPORT_COMPRESSION
+    from storage import close_engine, export_leads_csv, init_db
+
+    end = args.end or date.today()
+    start = args.start or end - timedelta(days=30)
+    compression = EXPORT_COMPRESSION if args.compression is None else args.compression
+    output = args.output
+    if output is None:
+        suffix = {"gzip": ".gz", "zip": ".zip"}.get(compression, "")
+        output = Path(f"leads_{start.isoformat()}_{end.isoformat()}.csv{suffix}")
+
+    init_db()
+    try:
+        asyncio.run(export_leads_csv(_niche_id(args.niche), start, end, output, compression))
+    finally:
+        close_engine()
+    print(output)
+
+
+def cmd_resegment(args: argparse.Namespace) -> None:
+    from resegment import main
+
+    main(args.resegment_args)
+
+
+def cmd_vacuum(args: argparse.Namespace) -> None:
+    from storage import close_engine, init_db, vacuum
+
+    init_db()
+    close_engine()
+    before, after = vacuum()
+    print(f"{before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB")
+
+
+def cmd_archive(args: argparse.Namespace) -> None:
+    import asyncio
+
+    from config import ARCHIVE_AFTER_DAYS
+    from storage import archive_dir, archive_leads, auto_vacuum_enabled, close_engine, init_db
+
+    days = ARCHIVE_AFTER_DAYS if args.days is None else args.days
+    init_db()
+    try:
+        moved = asyncio.run(archive_leads(date.today() - timedelta(days=days)))
+        incremental = asyncio.run(auto_vacuum_enabled())
+    finally:
+        close_engine()
+    print(f"{moved} leads older than {days} days moved to {archive_dir()}")
+    if not incremental:
+        print("The database file does not shrink until 'python -m cli vacuum' is run once")
+
+
+def cmd_replay(args: argparse.Namespace) -> None:
+    import asyncio
+
+    from storage import close_engine, init_db, replay_dead_outbox
+
+    init_db()
+    try:
+        count = asyncio.run(replay_dead_outbox(_niche_id(args.niche), args.sink))
+    finally:
+        close_engine()
+    print(f"{count} dead deliveries queued again; the running bot will send them")
+
+
+def cmd_rename_niche(args: argparse.Namespace) -> None:
+    import asyncio
+
+    from storage import close_engine, init_db, rename_niche
+
+    init_db()
+    try:
+        moved = asyncio.run(rename_niche(args.old, args.new))
+    except ValueError as exc:
+        sys.exit(str(exc))
+    finally:
+        close_engine()
+    print(f"{moved} leads moved from {args.old} to {args.new}; set NICHE_ID={args.new} in its env file")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Lead bot admin commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    niche_help = "NICHE_ID to work on, or 'all' (default: the niche of ENV_FILE)"
+
+    stats = commands.add_parser("stats", help="lead counts by status")
+    stats.add_argument("start", nargs="?", type=date.fromisoformat, help="YYYY-MM-DD")
+    stats.add_argument("end", nargs="?", type=date.fromisoformat, help="YYYY-MM-DD")
+    stats.add_argument("--by", choices=("day", "budget", "timeframe", "region"), help="breakdown")
+    stats.add_argument("--niche", help=niche_help)
+    stats.add_argument("--json", action="store_true", help="print JSON")
+    stats.set_defaults(handler=cmd_stats)
+
+    export = commands.add_parser("export", help="export leads to CSV (default: the last 30 days)")
+    export.add_argument("start", nargs="?", type=date.fromisoformat, help="YYYY-MM-DD")
+    export.add_argument("end", nargs="?", type=date.fromisoformat, help="YYYY-MM-DD")
+    export.add_argument("-o", "--output", type=Path, help="output file")
+    export.add_argument(
+        "--compression", choices=("", "gzip", "zip"), help="default: EXPORT_COMPRESSION"
+    )
+    export.add_argument("--niche", help=niche_help)
+    export.set_defaults(handler=cmd_export)
+
+    resegment = commands.add_parser(
+        "resegment", help="recompute lead statuses (options: python -m cli resegment --help)", add_help=False
+    )
+    resegment.set_defaults(handler=cmd_resegment)
+
+    vacuum = commands.add_parser("vacuum", help="compact the database file")
+    vacuum.set_defaults(handler=cmd_vacuum)
+
+    archive = commands.add_parser("archive", help="move old leads to monthly archive files")
+    archive.add_argument("--days", type=int, help="archive leads older than this (default: ARCHIVE_AFTER_DAYS)")
+    archive.set_defaults(handler=cmd_archive)
+
+    replay = commands.add_parser("replay", help="retry dead-lettered integration deliveries")
+    replay.add_argument("--sink", choices=("crm", "sheets", "csv"), help="only this integration")
+    replay.add_argument("--niche", help=niche_help)
+    replay.set_defaults(handler=cmd_replay)
+
+    rename = commands.add_parser("rename-niche", help="move a niche's stored data to a new NICHE_ID")
+    rename.add_argument("old", help="NICHE_ID the data is stored under")
+    rename.add_argument("new", help="NICHE_ID to move it to; must have no data yet")
+    rename.set_defaults(handler=cmd_rename_niche)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    # resegment keeps its own parser (resegment.py works standalone too) and gets the rest.
+    if args.command == "resegment":
+        args.resegment_args = extra
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
 import os
-from dotenv import load_dotenv
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from dotenv import dotenv_values, load_dotenv
 
 ENV_FILE = os.getenv("ENV_FILE", ".env")
 load_dotenv(ENV_FILE, override=True)
@@ -13,75 +18,257 @@ def _format_money(value: int) -> str:
     return f"{value:,}".replace(",", " ")
 
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise RuntimeError("BOT_TOKEN is required")
+@dataclass(frozen=True)
+class FormStep:
+    """One question of the lead form; the form is a tuple of these, see ``_lead_form``.
 
-ADMIN_IDS = {int(x) for x in _split_csv(os.getenv("ADMIN_IDS", "")) if x.isdigit()}
+    Choice steps store the chosen option key in ``answer_field`` and its label in
+    ``label_field``; other steps store the validated answer in ``answer_field``.
+    ``branches`` maps an option key to the name of the step that follows it (None ends
+    the form), otherwise the next step in order follows.
+    """
 
-# Niche settings
-NICHE_NAME = os.getenv("NICHE_NAME", "Ипотека")
-CURRENCY_SYMBOL = os.getenv("CURRENCY_SYMBOL", "$")
+    name: str
+    kind: str  # "text", "phone", "email" or "choice"
+    question: str
+    answer_field: str
+    label_field: str = ""
+    options: tuple[dict[str, Any], ...] = ()
+    allow_text: bool = False  # choice steps: a typed answer is accepted as well
+    skippable: bool = False
+    error: str = ""
+    branches: Mapping[str, str | None] = field(default_factory=dict)
 
-# Messaging overrides (optional)
-INTRO_TEXT = os.getenv(
-    "INTRO_TEXT",
-    f"Привет! Я помогу вам подобрать {NICHE_NAME.lower()}.\n"
-    "Ответьте на несколько вопросов — это займёт всего пару минут.",
-)
-QUESTION_NAME = os.getenv("QUESTION_NAME", "Как вас зовут?")
-QUESTION_PHONE = os.getenv("QUESTION_PHONE", "Поделитесь, пожалуйста, вашим номером телефона.")
-QUESTION_EMAIL = os.getenv("QUESTION_EMAIL", "Можете оставить email для получения подробностей.")
-QUESTION_BUDGET = os.getenv("QUESTION_BUDGET", "Какую сумму кредита планируете?")
-QUESTION_REGION = os.getenv("QUESTION_REGION", "В каком регионе хотите взять ипотеку?")
-QUESTION_TIMEFRAME = os.getenv("QUESTION_TIMEFRAME", "Когда планируете оформить ипотеку?")
-QUESTION_CONTACTED = os.getenv("QUESTION_CONTACTED", "Уже обращались к банкам или брокерам?")
-THANK_YOU_MESSAGE = os.getenv(
-    "THANK_YOU_MESSAGE",
-    "Спасибо! Мы получили вашу заявку и свяжемся с вами в ближайшее время.",
-)
-DUPLICATE_MESSAGE = os.getenv(
-    "DUPLICATE_MESSAGE",
-    "Спасибо! Мы уже получили заявку с этим номером и скоро свяжемся.",
-)
 
-# Budget brackets
-BUDGET_LOW_MAX = int(os.getenv("BUDGET_LOW_MAX", "100000"))
-BUDGET_MID_MAX = int(os.getenv("BUDGET_MID_MAX", "300000"))
-
-BUDGET_OPTIONS = [
-    {
-        "key": "low",
-        "label": f"До {_format_money(BUDGET_LOW_MAX)}{CURRENCY_SYMBOL}",
-        "min": 0,
-        "max": BUDGET_LOW_MAX,
-    },
-    {
-        "key": "mid",
-        "label": f"{_format_money(BUDGET_LOW_MAX)}–{_format_money(BUDGET_MID_MAX)}{CURRENCY_SYMBOL}",
-        "min": BUDGET_LOW_MAX,
-        "max": BUDGET_MID_MAX,
-    },
-    {
-        "key": "high",
-        "label": f"Более {_format_money(BUDGET_MID_MAX)}{CURRENCY_SYMBOL}",
-        "min": BUDGET_MID_MAX,
-        "max": None,
-    },
-]
+@dataclass(frozen=True)
+class NicheSettings:
+    """Everything that differs between niches (tenants) served by this process."""
+
+    niche_id: str
+    bot_token: str
+    admin_ids: frozenset[int]
+    niche_name: str
+    currency_symbol: str
+
+    # Messaging
+    intro_text: str
+    question_name: str
+    question_phone: str
+    question_email: str
+    question_budget: str
+    question_region: str
+    question_timeframe: str
+    question_contacted: str
+    thank_you_message: str
+    duplicate_message: str
+    returning_message: str
+    updated_message: str
+
+    # Form options
+    budget_options: tuple[dict[str, Any], ...]
+    timeframe_options: tuple[dict[str, Any], ...]
+    region_options: tuple[str, ...]
+    ask_email: bool
+    phone_min_digits: int
+    # Steps asked again when a returning user is recognised by phone (or email)
+    update_steps: tuple[str, ...]
+    duplicate_check_email: bool
+
+    # Segmentation rules
+    hot_budget_min: int
+    hot_max_days: int
+    warm_budget_min: int
+    warm_max_days: int
+
+    # Integrations
+    crm_webhook_url: str
+    google_sheets_webhook_url: str
+    google_sheets_csv_path: str
+    notify_on_duplicate: bool
+
+    # The lead form, in order
+    form: tuple[FormStep, ...]
+
+    # Option lookups by key, derived from the options above
+    budget_index: Mapping[str, dict[str, Any]] = field(init=False, repr=False)
+    timeframe_index: Mapping[str, dict[str, Any]] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "budget_index", {o["key"]: o for o in self.budget_options})
+        object.__setattr__(self, "timeframe_index", {o["key"]: o for o in self.timeframe_options})
+
+
+DEFAULT_NICHE_ID = "default"
+
+
+def load_niche(env: Mapping[str, str | None]) -> NicheSettings:
+    def get(name: str, default: str = "") -> str:
+        value = env.get(name)
+        return default if value is None else value
+
+    niche_name = get("NICHE_NAME", "Ипотека")
+    currency = get("CURRENCY_SYMBOL", "$")
+
+    # Budget brackets
+    budget_low_max = int(get("BUDGET_LOW_MAX", "100000"))
+    budget_mid_max = int(get("BUDGET_MID_MAX", "300000"))
+    budget_options = (
+        {
+            "key": "low",
+            "label": f"До {_format_money(budget_low_max)}{currency}",
+            "min": 0,
+            "max": budget_low_max,
+        },
+        {
+            "key": "mid",
+            "label": f"{_format_money(budget_low_max)}–{_format_money(budget_mid_max)}{currency}",
+            "min": budget_low_max,
+            "max": budget_mid_max,
+        },
+        {
+            "key": "high",
+            "label": f"Более {_format_money(budget_mid_max)}{currency}",
+            "min": budget_mid_max,
+            "max": None,
+        },
+    )
+
+    settings = dict(
+        # Stored data is keyed by this id, so it must not follow the display name.
+        niche_id=get("NICHE_ID") or DEFAULT_NICHE_ID,
+        bot_token=get("BOT_TOKEN"),
+        admin_ids=frozenset(int(x) for x in _split_csv(get("ADMIN_IDS")) if x.isdigit()),
+        niche_name=niche_name,
+        currency_symbol=currency,
+        intro_text=get(
+            "INTRO_TEXT",
+            f"Привет! Я помогу вам подобрать {niche_name.lower()}.\n"
+            "Ответьте на несколько вопросов — это займёт всего пару минут.",
+        ),
+        question_name=get("QUESTION_NAME", "Как вас зовут?"),
+        question_phone=get("QUESTION_PHONE", "Поделитесь, пожалуйста, вашим номером телефона."),
+        question_email=get("QUESTION_EMAIL", "Можете оставить email для получения подробностей."),
+        question_budget=get("QUESTION_BUDGET", "Какую сумму кредита планируете?"),
+        question_region=get("QUESTION_REGION", "В каком регионе хотите взять ипотеку?"),
+        question_timeframe=get("QUESTION_TIMEFRAME", "Когда планируете оформить ипотеку?"),
+        question_contacted=get("QUESTION_CONTACTED", "Уже обращались к банкам или брокерам?"),
+        thank_you_message=get(
+            "THANK_YOU_MESSAGE",
+            "Спасибо! Мы получили вашу заявку и свяжемся с вами в ближайшее время.",
+        ),
+        duplicate_message=get(
+            "DUPLICATE_MESSAGE",
+            "Спасибо! Мы уже получили заявку с этим номером и скоро свяжемся.",
+        ),
+        returning_message=get(
+            "RETURNING_MESSAGE",
+            "Вы уже оставляли заявку. Ответьте на пару вопросов — и мы её обновим.",
+        ),
+        updated_message=get("UPDATED_MESSAGE", "Спасибо! Заявка обновлена, скоро свяжемся."),
+        budget_options=budget_options,
+        timeframe_options=TIMEFRAME_OPTIONS,
+        # Optional region list (comma-separated). If empty, free text is used.
+        region_options=tuple(_split_csv(get("REGION_OPTIONS"))),
+        ask_email=get("ASK_EMAIL", "1") == "1",
+        phone_min_digits=int(get("PHONE_MIN_DIGITS", "10")),
+        update_steps=tuple(_split_csv(get("UPDATE_STEPS", "budget,timeframe"))),
+        duplicate_check_email=get("DUPLICATE_CHECK_EMAIL", "0") == "1",
+        hot_budget_min=int(get("HOT_BUDGET_MIN", str(budget_low_max))),
+        hot_max_days=int(get("HOT_MAX_DAYS", "30")),
+        warm_budget_min=int(get("WARM_BUDGET_MIN", str(budget_low_max))),
+        warm_max_days=int(get("WARM_MAX_DAYS", "90")),
+        crm_webhook_url=get("CRM_WEBHOOK_URL"),
+        google_sheets_webhook_url=get("GOOGLE_SHEETS_WEBHOOK_URL"),
+        google_sheets_csv_path=get("GOOGLE_SHEETS_CSV_PATH"),
+        notify_on_duplicate=get("NOTIFY_ON_DUPLICATE", "0") == "1",
+    )
+    return NicheSettings(**settings, form=_lead_form(settings))
+
+
+def _lead_form(settings: Mapping[str, Any]) -> tuple[FormStep, ...]:
+    """The questions asked by the bot. Add a FormStep here to ask something new; answers to
+    fields without a leads column are kept in the lead's raw payload."""
+    steps = [
+        FormStep(
+            name="name",
+            kind="text",
+            question=settings["question_name"],
+            answer_field="name",
+            error="Пожалуйста, напишите ваше имя.",
+        ),
+        FormStep(
+            name="phone",
+            kind="phone",
+            question=settings["question_phone"],
+            answer_field="phone",
+            error=(
+                "Не удалось распознать номер. Введите телефон в формате +7XXXXXXXXXX "
+                f"(мин. {settings['phone_min_digits']} цифр)."
+            ),
+        ),
+    ]
+    if settings["ask_email"]:
+        steps.append(
+            FormStep(
+                name="email",
+                kind="email",
+                question=settings["question_email"],
+                answer_field="email",
+                skippable=True,
+                error="Похоже на некорректный email. Попробуйте ещё раз или нажмите «Пропустить».",
+            )
+        )
+    steps += [
+        FormStep(
+            name="budget",
+            kind="choice",
+            question=settings["question_budget"],
+            answer_field="budget_key",
+            label_field="budget_label",
+            options=settings["budget_options"],
+        ),
+        FormStep(
+            name="region",
+            kind="choice",
+            question=settings["question_region"],
+            answer_field="region",
+            options=tuple({"key": region, "label": region} for region in settings["region_options"]),
+            allow_text=True,
+            error="Пожалуйста, укажите регион.",
+        ),
+        FormStep(
+            name="timeframe",
+            kind="choice",
+            question=settings["question_timeframe"],
+            answer_field="timeframe_key",
+            label_field="timeframe_label",
+            options=settings["timeframe_options"],
+        ),
+        FormStep(
+            name="contacted",
+            kind="choice",
+            question=settings["question_contacted"],
+            answer_field="contacted_before",
+            label_field="contacted_before_label",
+            options=({"key": "yes", "label": "Да"}, {"key": "no", "label": "Нет"}),
+        ),
+    ]
+    return tuple(steps)
+
+
+def load_niche_file(path: str) -> NicheSettings:
+    """Niche env files are read in isolation, so one tenant's values never leak into another."""
+    if not Path(path).is_file():
+        raise RuntimeError(f"Niche env file not found: {path}")
+    return load_niche(dotenv_values(path))
+
 
 # Timeframes
-TIMEFRAME_OPTIONS = [
+TIMEFRAME_OPTIONS = (
     {"key": "week", "label": "В течение недели", "max_days": 7},
     {"key": "month", "label": "В течение месяца", "max_days": 30},
     {"key": "quarter", "label": "Через 1–3 месяца", "max_days": 90},
-]
-
-# Segmentation rules
-HOT_BUDGET_MIN = int(os.getenv("HOT_BUDGET_MIN", str(BUDGET_LOW_MAX)))
-HOT_MAX_DAYS = int(os.getenv("HOT_MAX_DAYS", "30"))
-WARM_BUDGET_MIN = int(os.getenv("WARM_BUDGET_MIN", str(BUDGET_LOW_MAX)))
-WARM_MAX_DAYS = int(os.getenv("WARM_MAX_DAYS", "90"))
+)
 
 LEAD_STATUS_LABELS = {
     "hot": "Горячий",
@@ -89,20 +276,124 @@ LEAD_STATUS_LABELS = {
     "cold": "Холодный",
 }
 
-# Optional region list (comma-separated). If empty, free text is used.
-REGION_OPTIONS = _split_csv(os.getenv("REGION_OPTIONS", ""))
+# The niche configured by ENV_FILE / the process environment (single-niche mode).
+NICHE = load_niche(os.environ)
+
+# Multi-niche mode: comma-separated env files, one per niche, all served by one process.
+NICHE_ENV_FILES = _split_csv(os.getenv("NICHE_ENV_FILES", ""))
+
 
-# Form toggles
-ASK_EMAIL = os.getenv("ASK_EMAIL", "1") == "1"
+def load_niches(env_files: list[str] | None = None) -> list[NicheSettings]:
+    """Niches from NICHE_ENV_FILES (one env file per niche) or the single configured niche."""
+    env_files = NICHE_ENV_FILES if env_files is None else env_files
+    if not env_files:
+        return [NICHE]
+    niches = [load_niche_file(path) for path in env_files]
+    ids = [niche.niche_id for niche in niches]
+    if len(set(ids)) != len(ids):
+        raise RuntimeError(f"NICHE_ID must be unique per env file, got {ids}")
+    return niches
 
-# Validation
-PHONE_MIN_DIGITS = int(os.getenv("PHONE_MIN_DIGITS", "10"))
 
-# Integrations
-CRM_WEBHOOK_URL = os.getenv("CRM_WEBHOOK_URL", "")
-GOOGLE_SHEETS_WEBHOOK_URL = os.getenv("GOOGLE_SHEETS_WEBHOOK_URL", "")
-GOOGLE_SHEETS_CSV_PATH = os.getenv("GOOGLE_SHEETS_CSV_PATH", "")
+# Telegram update delivery (webhook mode, see `python app.py --mode webhook`)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+TELEGRAM_WEBHOOK_HOST = os.getenv("TELEGRAM_WEBHOOK_HOST", "0.0.0.0")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", os.getenv("PORT", "8080")))
+TELEGRAM_WEBHOOK_MAX_CONCURRENCY = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONCURRENCY", "64"))
+
+# Logging: LOG_FORMAT "text" or "json"; repeated warnings/errors are rate-limited per source
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records waiting to be written
+LOG_ERROR_RATE = float(os.getenv("LOG_ERROR_RATE", "0.2"))  # records per second per source
+LOG_ERROR_BURST = float(os.getenv("LOG_ERROR_BURST", "5"))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100"))  # past the limit, keep 1 in N
+
+# Sharded processing (`python app.py --workers N`): updates go to N worker processes by chat
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))  # 0: handle updates in this process
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))  # queued updates per worker
+WORKER_MAX_CONCURRENCY = int(os.getenv("WORKER_MAX_CONCURRENCY", "64"))  # updates in progress per worker
+
+# Outbound Bot API scheduler (per bot): rate limits and retries on 429
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))  # messages per second
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # messages per second per chat
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+# Integrations (URLs and the CSV path are per niche, see NicheSettings)
+# Batch mode: >1 sends leads to Google Sheets as one JSON array per request.
+GOOGLE_SHEETS_BATCH_SIZE = int(os.getenv("GOOGLE_SHEETS_BATCH_SIZE", "1"))
+GOOGLE_SHEETS_BATCH_WINDOW_SECONDS = float(os.getenv("GOOGLE_SHEETS_BATCH_WINDOW_SECONDS", "10"))
 WEBHOOK_TIMEOUT_SECONDS = int(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+CRM_TIMEOUT_SECONDS = float(os.getenv("CRM_TIMEOUT_SECONDS", str(WEBHOOK_TIMEOUT_SECONDS)))
+GOOGLE_SHEETS_TIMEOUT_SECONDS = float(
+    os.getenv("GOOGLE_SHEETS_TIMEOUT_SECONDS", str(WEBHOOK_TIMEOUT_SECONDS))
+)
+
+# Shared HTTP client for integrations
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "0") == "1"
+
+# CSV sink (GOOGLE_SHEETS_CSV_PATH): rows are written in batches by a background thread
+# 0: write as soon as nothing else is queued; more: collect rows that long, fewer writes
+CSV_FLUSH_SECONDS = float(os.getenv("CSV_FLUSH_SECONDS", "0"))
+CSV_FSYNC = os.getenv("CSV_FSYNC", "batch")  # "batch", "rotate" or "never"
+CSV_ROTATE = os.getenv("CSV_ROTATE", "")  # "" or "daily"
+CSV_ROTATE_MAX_BYTES = int(os.getenv("CSV_ROTATE_MAX_BYTES", "0"))
+
+# SQLite storage engine
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_GROUP_COMMIT_MAX = int(os.getenv("DB_GROUP_COMMIT_MAX", "64"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+
+# Per-user flood control: FLOOD_RATE updates per second, bursts of FLOOD_BURST (0 turns it off)
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "1"))
+FLOOD_BURST = float(os.getenv("FLOOD_BURST", "5"))
+FLOOD_DEBOUNCE_SECONDS = float(os.getenv("FLOOD_DEBOUNCE_SECONDS", "1"))
+FLOOD_MAX_USERS = int(os.getenv("FLOOD_MAX_USERS", "100000"))
+FLOOD_LOG_EVERY = int(os.getenv("FLOOD_LOG_EVERY", "100"))
+
+# Dialog (FSM) storage: "sqlite" survives restarts, "memory" is aiogram's MemoryStorage
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_TTL_SECONDS = float(os.getenv("FSM_TTL_SECONDS", str(7 * 24 * 3600)))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_FLUSH_SECONDS = float(os.getenv("FSM_FLUSH_SECONDS", "1"))
+
+# Export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "")  # "", "gzip" or "zip"
+
+# Prometheus metrics endpoint (http://METRICS_HOST:METRICS_PORT/metrics); 0 turns it off
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Read-only pull API for CRM sync (http://PULL_API_HOST:PULL_API_PORT/leads); 0 turns it off
+PULL_API_HOST = os.getenv("PULL_API_HOST", "127.0.0.1")
+PULL_API_PORT = int(os.getenv("PULL_API_PORT", "0"))
+PULL_API_TOKEN = os.getenv("PULL_API_TOKEN", "")
+PULL_API_MAX_LIMIT = int(os.getenv("PULL_API_MAX_LIMIT", "10000"))
+
+# Archive: leads older than ARCHIVE_AFTER_DAYS move to monthly files (python -m cli archive)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "")  # default: "archive" next to the database
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+# Lead form funnel events: buffered in memory, written in batches
+FUNNEL_FLUSH_SECONDS = float(os.getenv("FUNNEL_FLUSH_SECONDS", "5"))
+FUNNEL_BATCH_SIZE = int(os.getenv("FUNNEL_BATCH_SIZE", "500"))
+FUNNEL_BUFFER_MAX = int(os.getenv("FUNNEL_BUFFER_MAX", "100000"))
+
+# Re-segmentation of stored leads (python resegment.py)
+RESEGMENT_CHUNK_SIZE = int(os.getenv("RESEGMENT_CHUNK_SIZE", "5000"))
 
-# Duplicate handling
-NOTIFY_ON_DUPLICATE = os.getenv("NOTIFY_ON_DUPLICATE", "0") == "1"
+# Outbox (background delivery to integrations)
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "900"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", str(WEBHOOK_TIMEOUT_SECONDS * 3)))
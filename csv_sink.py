@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from config import CSV_FLUSH_SECONDS, CSV_FSYNC, CSV_ROTATE, CSV_ROTATE_MAX_BYTES
+
+HEADERS = [
+    "created_at",
+    "name",
+    "phone",
+    "email",
+    "budget",
+    "budget_key",
+    "region",
+    "timeframe",
+    "timeframe_key",
+    "contacted_before",
+    "status",
+]
+FSYNC_POLICIES = ("batch", "rotate", "never")
+MAX_BATCH = 1000
+
+_STOP = object()
+_sinks: dict[Path, CsvSink] = {}
+_sinks_lock = threading.Lock()
+
+
+class CsvSink:
+    """Appends lead rows to a CSV file from a background thread.
+
+    Rows are written in batches, each with a single write call to a file kept open
+    between batches; append() returns once its row is written. With ``flush_seconds=0`` a
+    batch is whatever is queued when the thread gets to it, so a lone row goes out at once
+    and rows arriving during a write (or its fsync) go together in the next one. A
+    positive ``flush_seconds`` collects rows for that long after the first one, trading
+    latency for fewer writes.
+    ``fsync`` is "batch" (after every write), "rotate" (when a file is closed) or "never".
+    With ``rotate="daily"`` rows go to ``<name>-YYYY-MM-DD<suffix>``; with ``max_bytes`` a
+    full file is renamed to ``<name>-YYYYmmdd-HHMMSS<suffix>`` and a new one started. Every
+    new file starts with the header row.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        flush_seconds: float = 0.0,
+        fsync: str = "batch",
+        rotate: str = "",
+        max_bytes: int = 0,
+    ) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown CSV fsync policy: {fsync}")
+        if rotate not in ("", "daily"):
+            raise ValueError(f"Unknown CSV rotation: {rotate}")
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.rotate = rotate
+        self.max_bytes = max_bytes
+        self._queue: queue.Queue = queue.Queue()
+        self._file: BinaryIO | None = None
+        self._file_path: Path | None = None
+        self._file_day: date | None = None
+        self._size = 0
+        self._thread = threading.Thread(target=self._run, name=f"csv-sink-{path.name}", daemon=True)
+        self._thread.start()
+
+    async def append(self, row: dict[str, Any]) -> None:
+        future: Future = Future()
+        self._queue.put((row, future))
+        await asyncio.wrap_future(future)
+
+    def close(self) -> None:
+        """Write what is queued, close the file and stop the thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        stop = False
+        try:
+            while not stop:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.flush_seconds
+                while len(batch) < MAX_BATCH:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._write_batch(batch)
+        finally:
+            self._close_file()
+
+    def _write_batch(self, batch: list[tuple[dict[str, Any], Future]]) -> None:
+        futures = [future for _, future in batch if future.set_running_or_notify_cancel()]
+        buffer = io.StringIO(newline="")
+        writer = csv.DictWriter(buffer, fieldnames=HEADERS, extrasaction="ignore")
+        writer.writerows(row for row, _ in batch)
+        data = buffer.getvalue().encode()
+        try:
+            self._write(data)
+        except BaseException as exc:
+            logging.exception("CSV sink %s: write failed", self.path)
+            self._discard_partial_write()
+            for future in futures:
+                future.set_exception(exc)
+            return
+        for future in futures:
+            future.set_result(None)
+
+    def _write(self, data: bytes) -> None:
+        today = date.today()
+        if self._file is not None and self.rotate == "daily" and today != self._file_day:
+            self._close_file()
+        if self._file is None:
+            self._open(today)
+        if self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+            self._close_file()
+            assert self._file_path is not None
+            self._file_path.rename(self._rotated_path(self._file_path))
+            self._open(today)
+        if not self._size:
+            data = self._header() + data
+        assert self._file is not None
+        self._file.write(data)
+        self._size += len(data)
+        if self.fsync == "batch":
+            os.fsync(self._file.fileno())
+
+    def _open(self, today: date) -> None:
+        path = self.path
+        if self.rotate == "daily":
+            path = path.with_name(f"{path.stem}-{today.isoformat()}{path.suffix}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Unbuffered: every batch is exactly one write() call.
+        self._file = path.open("ab", buffering=0)
+        self._file_path = path
+        self._file_day = today
+        self._size = self._file.seek(0, os.SEEK_END)
+
+    def _discard_partial_write(self) -> None:
+        # _size only counts completed writes, so this cuts off a half-written batch.
+        if self._file is None:
+            return
+        try:
+            self._file.truncate(self._size)
+        except OSError:
+            logging.exception("CSV sink %s: could not truncate a partial write", self.path)
+        self._file.close()
+        self._file = None
+
+    def _close_file(self) -> None:
+        if self._file is None:
+            return
+        try:
+            if self.fsync != "never":
+                os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+            self._file = None
+
+    def _rotated_path(self, path: Path) -> Path:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        rotated = path.with_name(f"{path.stem}-{stamp}{path.suffix}")
+        counter = 1
+        while rotated.exists():
+            rotated = path.with_name(f"{path.stem}-{stamp}-{counter}{path.suffix}")
+            counter += 1
+        return rotated
+
+    @staticmethod
+    def _header() -> bytes:
+        buffer = io.StringIO(newline="")
+        csv.writer(buffer).writerow(HEADERS)
+        return buffer.getvalue().encode()
+
+
+def get_sink(path: Path) -> CsvSink:
+    """The sink of ``path``, started on first use; niches sharing a file share its sink."""
+    key = path.resolve()
+    with _sinks_lock:
+        sink = _sinks.get(key)
+        if sink is None:
+            sink = _sinks[key] = CsvSink(
+                path,
+                flush_seconds=CSV_FLUSH_SECONDS,
+                fsync=CSV_FSYNC,
+                rotate=CSV_ROTATE,
+                max_bytes=CSV_ROTATE_MAX_BYTES,
+            )
+    return sink
+
+
+async def close_all() -> None:
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+    for sink in sinks:
+        await asyncio.to_thread(sink.close)
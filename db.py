@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+_STOP = object()
+
+
+def connect(path: Path, read_only: bool = False, synchronous: str = "NORMAL") -> sqlite3.Connection:
+    if read_only:
+        conn = sqlite3.connect(
+            f"file:{path}?mode=ro",
+            uri=True,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+    else:
+        conn = sqlite3.connect(
+            path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        # Takes effect when the first table is created, or at the next VACUUM of an existing file.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
+
+class StorageEngine:
+    """One writer thread owning a persistent connection plus a pool of reader threads.
+
+    Writes queued while a transaction is running are committed together with it
+    (group commit); each job runs inside its own savepoint, so one failing job does
+    not roll back the others.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        read_pool_size: int = 4,
+        group_commit_max: int = 64,
+        synchronous: str = "NORMAL",
+    ) -> None:
+        self.path = path
+        self.group_commit_max = group_commit_max
+        self.synchronous = synchronous
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: threading.Thread | None = None
+        self._readers = ThreadPoolExecutor(
+            max_workers=read_pool_size,
+            thread_name_prefix="sqlite-reader",
+        )
+        self._local = threading.local()
+        self._read_conns: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                return
+            if self._closed:
+                raise RuntimeError("Storage engine is closed")
+            # Open the writer connection here so WAL mode is set before any reader connects.
+            conn = connect(self.path, synchronous=self.synchronous)
+            self._writer = threading.Thread(
+                target=self._write_loop,
+                args=(conn,),
+                name="sqlite-writer",
+                daemon=True,
+            )
+            self._writer.start()
+
+    def submit_write(self, fn: Callable[..., Any], *args: Any) -> Future:
+        self.start()
+        future: Future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    def submit_read(self, fn: Callable[..., Any], *args: Any) -> Future:
+        self.start()
+        return self._readers.submit(self._run_read, fn, args)
+
+    async def write(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.wrap_future(self.submit_write(fn, *args))
+
+    async def read(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.wrap_future(self.submit_read(fn, *args))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            writer = self._writer
+        if writer is not None:
+            self._queue.put(_STOP)
+            writer.join()
+        self._readers.shutdown(wait=True)
+        for conn in self._read_conns:
+            conn.close()
+
+    def _run_read(self, fn: Callable[..., Any], args: tuple) -> Any:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path, read_only=True)
+            self._local.conn = conn
+            with self._lock:
+                self._read_conns.append(conn)
+        return fn(conn, *args)
+
+    def _write_loop(self, conn: sqlite3.Connection) -> None:
+        try:
+            while True:
+                job = self._queue.get()
+                if job is _STOP:
+                    return
+                batch = [job]
+                stop = False
+                while len(batch) < self.group_commit_max:
+                    try:
+                        job = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is _STOP:
+                        stop = True
+                        break
+                    batch.append(job)
+                self._commit_batch(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list[tuple]) -> None:
+        results: list[tuple[Future, Any, BaseException | None]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = fn(conn, *args)
+                except BaseException as exc:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, exc))
+                else:
+                    conn.execute("RELEASE job")
+                    results.append((future, result, None))
+            conn.execute("COMMIT")
+        except BaseException as exc:
+            logging.exception("SQLite group commit failed (%s jobs)", len(batch))
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for future, result, exc in results:
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
@@ -1,32 +1,46 @@
 const SHEET_NAME = "Leads";
 
+const HEADERS = [
+  "created_at",
+  "niche",
+  "name",
+  "phone",
+  "email",
+  "budget",
+  "region",
+  "timeframe",
+  "contacted_before",
+  "status",
+];
+
+// Accepts either a single lead object or a JSON array of leads (GOOGLE_SHEETS_BATCH_SIZE > 1).
 function doPost(e) {
   const body = e && e.postData && e.postData.contents ? e.postData.contents : "{}";
   const data = JSON.parse(body);
+  const leads = Array.isArray(data) ? data : [data];
 
-  const ss = SpreadsheetApp.getActiveSpreadsheet();
-  const sheet = ss.getSheetByName(SHEET_NAME) || ss.insertSheet(SHEET_NAME);
+  const rows = leads.map((lead) => HEADERS.map((key) => (lead[key] !== undefined ? lead[key] : "")));
 
-  const headers = [
-    "created_at",
-    "niche",
-    "name",
-    "phone",
-    "email",
-    "budget",
-    "region",
-    "timeframe",
-    "contacted_before",
-    "status",
-  ];
+  // Concurrent executions would otherwise compute the same getLastRow() and overwrite each other.
+  const lock = LockService.getScriptLock();
+  lock.waitLock(30000);
+  try {
+    const ss = SpreadsheetApp.getActiveSpreadsheet();
+    const sheet = ss.getSheetByName(SHEET_NAME) || ss.insertSheet(SHEET_NAME);
 
-  if (sheet.getLastRow() === 0) {
-    sheet.appendRow(headers);
-  }
+    const lastRow = sheet.getLastRow();
+    if (lastRow === 0) {
+      rows.unshift(HEADERS);
+    }
 
-  const row = headers.map((key) => (data[key] !== undefined ? data[key] : ""));
-  sheet.appendRow(row);
+    if (rows.length > 0) {
+      sheet.getRange(lastRow + 1, 1, rows.length, HEADERS.length).setValues(rows);
+    }
+    SpreadsheetApp.flush();
+  } finally {
+    lock.releaseLock();
+  }
 
-  return ContentService.createTextOutput(JSON.stringify({ ok: true }))
+  return ContentService.createTextOutput(JSON.stringify({ ok: true, count: leads.length }))
     .setMimeType(ContentService.MimeType.JSON);
 }
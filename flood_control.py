@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject, Update
+
+import metrics
+from ratelimit import KeyedTokenBuckets
+
+DROPPED = metrics.Counter("bot_flood_dropped_total", "Updates dropped by flood control", ("reason",))
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    """Outer update middleware that drops what a user sends too fast. A dropped button
+    press is still answered, so the button stops spinning.
+
+    Each user gets a token bucket of ``rate`` updates per second with bursts of ``burst``.
+    A press of the same button while the previous one is still handled, or within
+    ``debounce_seconds`` after it, is dropped too, so a double tap on the last question
+    cannot save the lead twice. Per-user state is bounded by ``max_users`` and expires
+    once idle. A throttled user is logged on the first drop and then every ``log_every``
+    drops.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        debounce_seconds: float,
+        max_users: int = 100_000,
+        log_every: int = 100,
+    ) -> None:
+        self.buckets = KeyedTokenBuckets(rate, burst, max_keys=max_users) if rate > 0 else None
+        self.debounce_seconds = debounce_seconds
+        self.max_users = max_users
+        self.log_every = max(1, log_every)
+        # (user id, callback data) -> when its handling finished; inf while in progress
+        self._presses: OrderedDict[tuple[int, str], float] = OrderedDict()
+        self._drops: OrderedDict[int, int] = OrderedDict()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        press = None
+        if isinstance(event, Update) and event.callback_query is not None:
+            press = (user.id, event.callback_query.data or "")
+            finished_at = self._presses.get(press)
+            if finished_at is not None and time.monotonic() - finished_at < self.debounce_seconds:
+                self._drop(user.id, "debounce")
+                await self._answer(data, event)
+                return None
+
+        if self.buckets is not None and not self.buckets.get(user.id).try_take():
+            self._drop(user.id, "rate")
+            await self._answer(data, event)
+            return None
+
+        if press is None:
+            return await handler(event, data)
+        self._presses[press] = math.inf
+        self._presses.move_to_end(press)
+        try:
+            return await handler(event, data)
+        finally:
+            self._presses[press] = time.monotonic()
+            self._presses.move_to_end(press)
+            self._expire_presses()
+
+    def _expire_presses(self) -> None:
+        now = time.monotonic()
+        for _ in range(len(self._presses)):
+            press, finished_at = next(iter(self._presses.items()))
+            if finished_at == math.inf:
+                # Still being handled: kept however full the map is, or a second press
+                # could get through while the first is saving the lead.
+                self._presses.move_to_end(press)
+                continue
+            if len(self._presses) <= self.max_users and now - finished_at < self.debounce_seconds:
+                break
+            del self._presses[press]
+
+    @staticmethod
+    async def _answer(data: dict[str, Any], event: TelegramObject) -> None:
+        if not isinstance(event, Update) or event.callback_query is None:
+            return
+        bot: Bot = data["bot"]
+        try:
+            await bot.answer_callback_query(event.callback_query.id)
+        except TelegramAPIError as exc:
+            # Too old to answer, for instance; the press is dropped either way.
+            logging.debug("Could not answer dropped callback query: %s", exc)
+
+    def _drop(self, user_id: int, reason: str) -> None:
+        DROPPED.inc(reason)
+        count = self._drops.pop(user_id, 0) + 1
+        self._drops[user_id] = count
+        while len(self._drops) > self.max_users:
+            self._drops.popitem(last=False)
+        if count % self.log_every == 1 or self.log_every == 1:
+            logging.warning("Flood control: user %s, %s updates dropped (%s)", user_id, count, reason)
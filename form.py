@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping
+
+from aiogram.types import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
+)
+
+from config import FormStep, NicheSettings
+
+# Steps keep the state names of the former LeadForm StatesGroup, so dialogs persisted
+# by the FSM storage before the form became data resume where they were.
+STATE_GROUP = "LeadForm"
+SKIP_WORDS = frozenset({"пропустить", "skip", "нет"})
+INVALID_CHOICE = "Выберите вариант из списка."
+CALLBACK_DATA_MAX_BYTES = 64
+
+START_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[[InlineKeyboardButton(text="Начать", callback_data="lead_start")]]
+)
+CONTACT_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="Поделиться контактом", request_contact=True)]],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
+REMOVE_KEYBOARD = ReplyKeyboardRemove()
+
+
+def normalize_phone(text: str, min_digits: int) -> str | None:
+    if not text:
+        return None
+    digits = "".join(ch for ch in text if ch.isdigit())
+    if len(digits) < min_digits:
+        return None
+    return digits
+
+
+def is_valid_email(text: str) -> bool:
+    if not text or "@" not in text:
+        return False
+    local, _, domain = text.partition("@")
+    return bool(local.strip()) and "." in domain
+
+
+@dataclass(frozen=True)
+class CompiledStep:
+    """A FormStep with everything a handler needs precomputed: state name, keyboard,
+    option index and transitions."""
+
+    spec: FormStep
+    state: str
+    markup: InlineKeyboardMarkup | ReplyKeyboardMarkup | None
+    options: Mapping[str, dict[str, Any]]
+    next_step: str | None
+    branches: Mapping[str, str | None]
+    skip_data: str
+    accepts_text: bool
+    phone_min_digits: int
+
+    def parse_text(self, text: str) -> dict[str, Any] | None:
+        """FSM data updates for a typed answer, or None if it is not valid."""
+        spec = self.spec
+        text = (text or "").strip()
+        if spec.skippable and text.lower() in SKIP_WORDS:
+            return self._skip()
+        if spec.kind == "phone":
+            phone = normalize_phone(text, self.phone_min_digits)
+            return {spec.answer_field: phone} if phone else None
+        if spec.kind == "email":
+            return {spec.answer_field: text} if is_valid_email(text) else None
+        if not text:
+            return None
+        if spec.label_field:
+            return {spec.answer_field: text, spec.label_field: text}
+        return {spec.answer_field: text}
+
+    def parse_callback(self, data: str) -> dict[str, Any] | None:
+        """FSM data updates for a pressed button, or None if it is not one of this step's."""
+        if self.spec.skippable and data == self.skip_data:
+            return self._skip()
+        name, _, key = data.partition(":")
+        option = self.options.get(key) if name == self.spec.name else None
+        if option is None:
+            return None
+        if self.spec.label_field:
+            return {self.spec.answer_field: key, self.spec.label_field: option["label"]}
+        return {self.spec.answer_field: key}
+
+    def next_step_for(self, answer: Mapping[str, Any]) -> str | None:
+        """Name of the step after ``answer``; None when the form is complete."""
+        if not self.branches:
+            return self.next_step
+        return self.branches.get(answer.get(self.spec.answer_field), self.next_step)
+
+    def _skip(self) -> dict[str, Any]:
+        if self.spec.label_field:
+            return {self.spec.answer_field: None, self.spec.label_field: None}
+        return {self.spec.answer_field: None}
+
+
+@dataclass(frozen=True)
+class CompiledForm:
+    first: CompiledStep
+    steps: Mapping[str, CompiledStep]
+    by_state: Mapping[str, CompiledStep]
+    fields: tuple[str, ...]
+    update_steps: tuple[str, ...]
+
+
+def compile_form(niche: NicheSettings) -> CompiledForm:
+    """Validate the niche's form and precompute it once, at startup."""
+    specs = niche.form
+    if not specs:
+        raise ValueError(f"Niche {niche.niche_id} has an empty form")
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate step names in the form of niche {niche.niche_id}: {names}")
+    unknown = set(niche.update_steps) - set(names)
+    if unknown:
+        raise ValueError(f"UPDATE_STEPS of niche {niche.niche_id} name unknown steps: {sorted(unknown)}")
+
+    steps: dict[str, CompiledStep] = {}
+    fields: list[str] = []
+    for index, spec in enumerate(specs):
+        next_step = names[index + 1] if index + 1 < len(names) else None
+        for key, target in spec.branches.items():
+            if target is not None and target not in names:
+                raise ValueError(f"Step {spec.name!r} branches on {key!r} to unknown step {target!r}")
+        steps[spec.name] = CompiledStep(
+            spec=spec,
+            state=f"{STATE_GROUP}:{spec.name}",
+            markup=_build_markup(spec),
+            options=MappingProxyType({option["key"]: option for option in spec.options}),
+            next_step=next_step,
+            branches=MappingProxyType(dict(spec.branches)),
+            skip_data=f"skip_{spec.name}",
+            accepts_text=spec.kind != "choice" or spec.allow_text or not spec.options,
+            phone_min_digits=niche.phone_min_digits,
+        )
+        fields.extend(field for field in (spec.answer_field, spec.label_field) if field)
+
+    return CompiledForm(
+        first=steps[names[0]],
+        steps=MappingProxyType(steps),
+        by_state=MappingProxyType({step.state: step for step in steps.values()}),
+        fields=tuple(dict.fromkeys(fields)),
+        update_steps=niche.update_steps,
+    )
+
+
+def _build_markup(spec: FormStep) -> InlineKeyboardMarkup | ReplyKeyboardMarkup | None:
+    if spec.kind == "phone":
+        return CONTACT_KEYBOARD
+    rows = []
+    for option in spec.options:
+        data = f"{spec.name}:{option['key']}"
+        if len(data.encode()) > CALLBACK_DATA_MAX_BYTES:
+            raise ValueError(f"Option {option['key']!r} of step {spec.name!r} is too long for a button")
+        rows.append([InlineKeyboardButton(text=option["label"], callback_data=data)])
+    if spec.skippable:
+        rows.append([InlineKeyboardButton(text="Пропустить", callback_data=f"skip_{spec.name}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from storage import get_engine
+
+
+@dataclass
+class _Record:
+    state: str | None = None
+    data: dict[str, Any] = field(default_factory=dict)
+    touched_at: float = field(default_factory=time.time)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage persisted in the fsm_state table behind an LRU write-behind cache.
+
+    Changes are flushed every ``flush_seconds``, so a crash can lose at most that much
+    dialog progress. Dialogs idle for longer than ``ttl_seconds`` are dropped both from
+    the cache and from the table.
+    """
+
+    def __init__(self, ttl_seconds: float, cache_size: int, flush_seconds: float) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.flush_seconds = flush_seconds
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: OrderedDict[str, _Record] = OrderedDict()
+        self._dirty: dict[str, _Record] = {}
+        # Records of the flush in progress; until it commits, the table may be older.
+        self._flushing: dict[str, _Record] = {}
+        self._flusher: asyncio.Task | None = None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record_key = self.key_builder.build(key)
+        record = await self._get_record(record_key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(record_key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._get_record(self.key_builder.build(key))).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        record_key = self.key_builder.build(key)
+        record = await self._get_record(record_key)
+        record.data = data.copy()
+        self._touch(record_key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._get_record(self.key_builder.build(key))).data.copy()
+
+    async def get_value(
+        self,
+        storage_key: StorageKey,
+        dict_key: str,
+        default: Any | None = None,
+    ) -> Any | None:
+        record = await self._get_record(self.key_builder.build(storage_key))
+        return record.data.get(dict_key, default)
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        self._flushing.update(dirty)
+        try:
+            await get_engine().write(_write_records, dirty)
+        except Exception:
+            # Keep newer in-memory changes, re-queue the rest for the next flush.
+            for key, record in dirty.items():
+                self._dirty.setdefault(key, record)
+            raise
+        finally:
+            for key, record in dirty.items():
+                if self._flushing.get(key) is record:
+                    del self._flushing[key]
+
+    async def _get_record(self, key: str) -> _Record:
+        record = self._cache.get(key)
+        if record is None:
+            record = self._dirty.get(key) or self._flushing.get(key)
+            if record is None:
+                loaded = await get_engine().read(_read_record, key) or _Record()
+                # Another coroutine may have cached this key while we were reading.
+                record = self._cache.get(key) or self._dirty.get(key) or self._flushing.get(key) or loaded
+            self._cache[key] = record
+            self._cache.move_to_end(key)
+            self._evict()
+        else:
+            self._cache.move_to_end(key)
+
+        if time.time() - record.touched_at > self.ttl_seconds:
+            record.state = None
+            record.data = {}
+        return record
+
+    def _touch(self, key: str, record: _Record) -> None:
+        record.touched_at = time.time()
+        self._dirty[key] = record
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop(), name="fsm-flush")
+
+    def _evict(self) -> None:
+        # Evicted records that are still dirty stay reachable through self._dirty, and those
+        # being flushed through self._flushing, until their write has committed.
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _flush_loop(self) -> None:
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+                if time.time() - last_purge >= min(self.ttl_seconds, 3600):
+                    last_purge = time.time()
+                    await self._purge_expired()
+            except Exception:
+                logging.exception("FSM storage flush failed")
+
+    async def _purge_expired(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for key in [key for key, record in self._cache.items() if record.touched_at < cutoff]:
+            if key not in self._dirty and key not in self._flushing:
+                del self._cache[key]
+        removed = await get_engine().write(_purge_records, cutoff)
+        if removed:
+            logging.info("FSM storage: evicted %s abandoned dialogs", removed)
+
+
+def _read_record(conn: sqlite3.Connection, key: str) -> _Record | None:
+    row = conn.execute("SELECT state, data, updated_at FROM fsm_state WHERE key=?", (key,)).fetchone()
+    if row is None:
+        return None
+    return _Record(state=row["state"], data=json.loads(row["data"]), touched_at=row["updated_at"])
+
+
+def _write_records(conn: sqlite3.Connection, records: dict[str, _Record]) -> None:
+    upserts = []
+    deletes = []
+    for key, record in records.items():
+        if record.state is None and not record.data:
+            deletes.append((key,))
+        else:
+            upserts.append(
+                (key, record.state, json.dumps(record.data, ensure_ascii=False), record.touched_at)
+            )
+    if deletes:
+        conn.executemany("DELETE FROM fsm_state WHERE key=?", deletes)
+    if upserts:
+        conn.executemany(
+            """
+            INSERT INTO fsm_state (key, state, data, updated_at) VALUES (?,?,?,?)
+            ON CONFLICT(key) DO UPDATE SET
+                state=excluded.state,
+                data=excluded.data,
+                updated_at=excluded.updated_at
+            """,
+            upserts,
+        )
+
+
+def _purge_records(conn: sqlite3.Connection, cutoff: float) -> int:
+    return conn.execute("DELETE FROM fsm_state WHERE updated_at < ?", (cutoff,)).rowcount
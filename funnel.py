@@ -0,0 +1,117 @@
+"""Lead form funnel: every step shown, answered or rejected is logged as a compact event.
+
+Events are buffered in memory and written in batches by a background task, so a form step
+never waits for the database. Each batch also updates funnel_rollups (per day, niche, step
+and event), which is what /funnel reads; the raw funnel_events log is kept for ad-hoc
+analysis only.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import date
+from enum import IntEnum
+from typing import Any
+
+import metrics
+from config import FUNNEL_BATCH_SIZE, FUNNEL_BUFFER_MAX, FUNNEL_FLUSH_SECONDS
+from storage import funnel_rollups, save_funnel_events
+
+
+class Event(IntEnum):
+    SHOWN = 1
+    ANSWERED = 2
+    INVALID = 3
+    COMPLETED = 4
+
+
+DROPPED = metrics.Counter("funnel_events_dropped_total", "Funnel events dropped because the buffer was full")
+
+# (ts, niche, user_id, step, event); bounded so a stalled database cannot eat the memory.
+_buffer: deque[tuple[int, str, int, str, int]] = deque(maxlen=FUNNEL_BUFFER_MAX)
+_task: asyncio.Task | None = None
+_wakeup: asyncio.Event | None = None
+
+
+def record(niche_id: str, user_id: int, step: str, event: Event) -> None:
+    if len(_buffer) == _buffer.maxlen:
+        DROPPED.inc()
+    _buffer.append((int(time.time()), niche_id, user_id, step, int(event)))
+    if len(_buffer) >= FUNNEL_BATCH_SIZE and _wakeup is not None:
+        _wakeup.set()
+
+
+def start() -> None:
+    global _task, _wakeup
+    if _task is not None:
+        return
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_run(), name="funnel-flush")
+
+
+async def stop() -> None:
+    """Stop the background writer and write what is still buffered."""
+    global _task, _wakeup
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
+    _wakeup = None
+    try:
+        await flush()
+    except Exception:
+        logging.exception("Funnel flush failed, %s events lost", len(_buffer))
+
+
+async def flush() -> int:
+    written = 0
+    while _buffer:
+        batch = [_buffer.popleft() for _ in range(min(len(_buffer), FUNNEL_BATCH_SIZE))]
+        try:
+            await save_funnel_events(batch)
+        except Exception:
+            # Put the batch back in front; the deque bound drops the newest on overflow.
+            _buffer.extendleft(reversed(batch))
+            raise
+        written += len(batch)
+    return written
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=FUNNEL_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await flush()
+        except Exception:
+            logging.exception("Funnel flush failed")
+
+
+async def report(
+    niche_id: str, steps: list[str], start: date | None = None, end: date | None = None
+) -> list[dict[str, Any]]:
+    """Per-step counts from the rollups, in form order (``steps``) and then any steps
+    that have since left the form.
+
+    Each item has ``step``, ``shown``, ``answered``, ``invalid`` and ``completed``.
+    """
+    counts = await funnel_rollups(niche_id, start, end)
+    order = list(steps) + sorted(set(counts) - set(steps))
+    result = []
+    for step in order:
+        by_event = counts.get(step, {})
+        result.append(
+            {"step": step}
+            | {event.name.lower(): by_event.get(int(event), 0) for event in Event}
+        )
+    return result
@@ -0,0 +1,72 @@
+"""Contacts of stored and archived leads per niche, so the form recognises a returning
+user at the phone step instead of at the end, when save_lead meets the UNIQUE constraint.
+
+Only hashes are kept (a set of ints, roughly 70 bytes per contact), so a hit means
+"probably known" and the caller confirms it with storage.find_lead; a miss costs no
+database round trip. Leads saved by another process after load() are not seen here and
+are still caught by save_lead.
+"""
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+from typing import Iterable
+
+from storage import get_engine
+
+_phones: dict[str, set[int]] = {}
+_emails: dict[str, set[int]] = {}
+
+
+def _email_key(email: str) -> int:
+    return hash(email.strip().lower())
+
+
+async def load(niche_ids: Iterable[str]) -> None:
+    """Index the contacts of every stored lead of ``niche_ids``; built off the event loop."""
+    phones, emails = await get_engine().read(_read_contacts, list(niche_ids))
+    _phones.update(phones)
+    _emails.update(emails)
+    logging.info("Lead index: %s phones", sum(len(keys) for keys in phones.values()))
+
+
+def add(niche_id: str, phone: str | None, email: str | None) -> None:
+    if phone:
+        _phones.setdefault(niche_id, set()).add(hash(phone))
+    if email:
+        _emails.setdefault(niche_id, set()).add(_email_key(email))
+
+
+def known_phone(niche_id: str, phone: str) -> bool:
+    return hash(phone) in _phones.get(niche_id, ())
+
+
+def known_email(niche_id: str, email: str) -> bool:
+    return _email_key(email) in _emails.get(niche_id, ())
+
+
+def clear() -> None:
+    _phones.clear()
+    _emails.clear()
+
+
+def _read_contacts(
+    conn: sqlite3.Connection, niche_ids: list[str]
+) -> tuple[dict[str, set[int]], dict[str, set[int]]]:
+    phones: dict[str, set[int]] = {niche_id: set() for niche_id in niche_ids}
+    emails: dict[str, set[int]] = {niche_id: set() for niche_id in niche_ids}
+    placeholders = ",".join("?" * len(niche_ids))
+    rows = conn.execute(
+        f"""
+        SELECT niche, phone, email FROM leads WHERE niche IN ({placeholders})
+        UNION ALL
+        SELECT niche, phone, email FROM archived_leads WHERE niche IN ({placeholders})
+        """,
+        niche_ids * 2,
+    )
+    for niche_id, phone, email in rows:
+        phones[niche_id].add(hash(phone))
+        if email:
+            emails[niche_id].add(_email_key(email))
+    return phones, emails
@@ -0,0 +1,410 @@
+"""Load test: complete lead form dialogs of many simulated users, fed straight into the
+dispatcher, against a fake Bot API and a stand-in CRM / Sheets webhook server.
+
+    python loadtest.py --users 2000 --concurrency 500
+    python loadtest.py --sink-latency 0.3 --sink-failure-rate 0.05 --save-baseline loadtest_baseline.json
+    python loadtest.py --compare loadtest_baseline.json
+
+Nothing leaves the machine and the database lives in a temporary directory unless --db
+is given. Bot API rate limits are lifted unless --telegram-limits is set, so the numbers
+describe this process rather than Telegram's quotas.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+USER_ID_BASE = 10_000_000
+BOT_ID_BASE = 900_000_000
+# Tracked against a baseline; a change beyond --tolerance in the wrong direction is a regression.
+HIGHER_IS_BETTER = ("dialogs_per_second", "updates_per_second")
+LOWER_IS_BETTER = ("p95", "p99")
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """Count and p50/p95/p99/max in milliseconds."""
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50) * 1000, 3),
+        "p95": round(percentile(values, 95) * 1000, 3),
+        "p99": round(percentile(values, 99) * 1000, 3),
+        "max": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def fake_bot_api(latency: float) -> Any:
+    """A Bot API session that answers every call locally after ``latency`` seconds."""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message
+
+    class FakeBotAPI(BaseSession):
+        def __init__(self) -> None:
+            super().__init__()
+            self.calls = 0
+            self._message_ids = itertools.count(1)
+
+        async def make_request(self, bot: Any, method: Any, timeout: int | None = None) -> Any:
+            self.calls += 1
+            if latency:
+                await asyncio.sleep(latency)
+            if method.__returning__ is Message:
+                return Message(
+                    message_id=next(self._message_ids),
+                    date=datetime.now(),
+                    chat=Chat(id=method.chat_id, type="private"),
+                    text=getattr(method, "text", None),
+                )
+            return True
+
+        async def stream_content(self, *args: Any, **kwargs: Any) -> Any:
+            yield b""
+
+        async def close(self) -> None:
+            pass
+
+    return FakeBotAPI()
+
+
+class FakeSinks:
+    """Local HTTP server standing in for the CRM and Sheets webhooks."""
+
+    def __init__(self, latency: float, failure_rate: float, rng: random.Random) -> None:
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = rng
+        self.requests = 0
+        self.failures = 0
+        self._runner: Any = None
+
+    async def start(self) -> str:
+        from aiohttp import web
+
+        async def handle(request: web.Request) -> web.Response:
+            await request.read()
+            self.requests += 1
+            if self.latency:
+                await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+            if self.rng.random() < self.failure_rate:
+                self.failures += 1
+                return web.Response(status=503, text="fake outage")
+            return web.json_response({"ok": True})
+
+        app = web.Application()
+        app.router.add_post("/{sink}", handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class Simulation:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.loop_lag: list[float] = []
+        self.completed = 0
+        self.updates = 0
+        self._update_ids = itertools.count(1)
+
+    async def run_user(self, index: int, bot: Any, dp: Any, form: Any) -> None:
+        from aiogram.types import CallbackQuery, Chat, Contact, Message, Update, User
+
+        user = User(id=USER_ID_BASE + index, is_bot=False, first_name=f"Load {index}")
+        chat = Chat(id=user.id, type="private")
+
+        def message(text: str | None = None, contact: Contact | None = None) -> Update:
+            update_id = next(self._update_ids)
+            return Update(
+                update_id=update_id,
+                message=Message(
+                    message_id=update_id,
+                    date=datetime.now(),
+                    chat=chat,
+                    from_user=user,
+                    text=text,
+                    contact=contact,
+                ),
+            )
+
+        def callback(data: str) -> Update:
+            update_id = next(self._update_ids)
+            return Update(
+                update_id=update_id,
+                callback_query=CallbackQuery(
+                    id=str(update_id),
+                    from_user=user,
+                    chat_instance=str(chat.id),
+                    data=data,
+                    message=Message(message_id=update_id, date=datetime.now(), chat=chat, text="-"),
+                ),
+            )
+
+        if not await self.feed("start", bot, dp, message("/start")):
+            return
+        if not await self.feed("lead_start", bot, dp, callback("lead_start")):
+            return
+
+        step = form.first
+        while step is not None:
+            if self.args.think_time:
+                await asyncio.sleep(self.rng.uniform(0, 2 * self.args.think_time))
+            spec = step.spec
+            if spec.kind == "phone":
+                phone = f"+7{9_000_000_000 + index}"
+                update = message(contact=Contact(phone_number=phone, first_name=user.first_name))
+                answer = step.parse_text(phone)
+            elif spec.kind == "choice" and step.options:
+                data = f"{spec.name}:{self.rng.choice(list(step.options))}"
+                update = callback(data)
+                answer = step.parse_callback(data)
+            else:
+                text = f"load{index}@example.com" if spec.kind == "email" else f"Load {index}"
+                update = message(text)
+                answer = step.parse_text(text)
+            if not await self.feed(spec.name, bot, dp, update):
+                return
+            next_step = step.next_step_for(answer or {})
+            step = form.steps[next_step] if next_step else None
+        self.completed += 1
+
+    async def feed(self, label: str, bot: Any, dp: Any, update: Any) -> bool:
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            self.errors[label] = self.errors.get(label, 0) + 1
+            logging.exception("Update failed at %s", label)
+            return False
+        finally:
+            self.updates += 1
+        self.latencies.setdefault(label, []).append(time.perf_counter() - started)
+        return True
+
+    async def monitor_loop_lag(self, interval: float = 0.01) -> None:
+        """How late the event loop wakes a sleeping task: the delay every update sees."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(0.0, loop.time() - started - interval))
+
+
+async def _outbox_counts() -> dict[str, int]:
+    from storage import get_engine
+
+    def read(conn: Any) -> dict[str, int]:
+        rows = conn.execute("SELECT status, COUNT(*) AS c FROM outbox GROUP BY status").fetchall()
+        return {row["status"]: row["c"] for row in rows}
+
+    return await get_engine().read(read)
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    from bot import create_bot, create_dispatcher
+    from config import load_niches
+    from form import compile_form
+
+    sim = Simulation(args)
+    sinks = FakeSinks(args.sink_latency, args.sink_failure_rate, sim.rng)
+    sink_url = await sinks.start()
+    niches = [
+        replace(
+            niche,
+            bot_token=f"{BOT_ID_BASE + i}:loadtest",
+            crm_webhook_url=f"{sink_url}/crm",
+            google_sheets_webhook_url=f"{sink_url}/sheets",
+            google_sheets_csv_path="",
+        )
+        for i, niche in enumerate(load_niches(args.niches))
+    ]
+    sessions = [fake_bot_api(args.api_latency) for _ in niches]
+    bots = [create_bot(niche, session=session) for niche, session in zip(niches, sessions)]
+    dp = create_dispatcher({bot.id: niche for bot, niche in zip(bots, niches)})
+    forms = [compile_form(niche) for niche in niches]
+    await dp.emit_startup(bots=bots, dispatcher=dp, **dp.workflow_data)
+
+    lag_task = asyncio.create_task(sim.monitor_loop_lag())
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def user(index: int) -> None:
+        async with slots:
+            which = index % len(bots)
+            await sim.run_user(index, bots[which], dp, forms[which])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(index) for index in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    # Integrations are delivered in the background; give the outbox time to catch up.
+    drain_started = time.perf_counter()
+    outbox = await _outbox_counts()
+    while outbox.get("pending") and time.perf_counter() - drain_started < args.drain_timeout:
+        await asyncio.sleep(0.1)
+        outbox = await _outbox_counts()
+    drain_seconds = time.perf_counter() - drain_started
+
+    lag_task.cancel()
+    await dp.emit_shutdown(bots=bots, dispatcher=dp, **dp.workflow_data)
+    await sinks.stop()
+
+    return {
+        "config": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "think_time": args.think_time,
+            "api_latency": args.api_latency,
+            "sink_latency": args.sink_latency,
+            "sink_failure_rate": args.sink_failure_rate,
+            "telegram_limits": args.telegram_limits,
+            "flood_control": args.flood_control,
+            "niches": len(niches),
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "dialogs": sim.completed,
+        "updates": sim.updates,
+        "dialogs_per_second": round(sim.completed / elapsed, 2),
+        "updates_per_second": round(sim.updates / elapsed, 2),
+        "errors": sim.errors,
+        "steps": {label: summarize(samples) for label, samples in sim.latencies.items()},
+        "loop_lag": summarize(sim.loop_lag),
+        "bot_api_calls": sum(session.calls for session in sessions),
+        "integrations": {
+            "requests": sinks.requests,
+            "failures": sinks.failures,
+            "outbox": outbox,
+            "drain_seconds": round(drain_seconds, 3),
+        },
+    }
+
+
+def print_report(result: dict[str, Any]) -> None:
+    print(
+        f"{result['dialogs']} dialogs in {result['elapsed_seconds']}s: "
+        f"{result['dialogs_per_second']} dialogs/s, {result['updates_per_second']} updates/s, "
+        f"{sum(result['errors'].values())} errors"
+    )
+    print(f"{'step':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(result["steps"].items()) + [("event loop lag", result["loop_lag"])]
+    for label, s in rows:
+        print(f"{label:<16}{s['count']:>8}{s['p50']:>10}{s['p95']:>10}{s['p99']:>10}{s['max']:>10}")
+    integrations = result["integrations"]
+    outbox = ", ".join(f"{status} {count}" for status, count in sorted(integrations["outbox"].items()))
+    print(
+        f"Bot API calls {result['bot_api_calls']}; webhooks {integrations['requests']} "
+        f"({integrations['failures']} failed); outbox: {outbox or 'empty'} "
+        f"after {integrations['drain_seconds']}s drain"
+    )
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """Human-readable regressions of ``result`` against ``baseline``; empty if none."""
+    if result["config"] != baseline.get("config"):
+        print("Warning: the baseline was recorded with different settings", file=sys.stderr)
+
+    pairs: list[tuple[str, float, float, bool]] = []
+    for key in HIGHER_IS_BETTER:
+        pairs.append((key, baseline.get(key, 0), result[key], True))
+    series = list(result["steps"].items()) + [("event loop lag", result["loop_lag"])]
+    for label, current in series:
+        previous = baseline["loop_lag"] if label == "event loop lag" else baseline.get("steps", {}).get(label)
+        if not previous:
+            continue
+        for key in LOWER_IS_BETTER:
+            pairs.append((f"{label} {key}", previous[key], current[key], False))
+
+    regressions = []
+    for name, previous, current, higher_is_better in pairs:
+        if not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{name}: {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Load-test the lead form with simulated users")
+    parser.add_argument("--users", type=int, default=1000, help="dialogs to run")
+    parser.add_argument("--concurrency", type=int, default=200, help="dialogs in flight at once")
+    parser.add_argument(
+        "--think-time", type=float, default=0.0, help="mean pause of a user between answers, seconds"
+    )
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Bot API latency, seconds")
+    parser.add_argument("--sink-latency", type=float, default=0.05, help="mean webhook latency, seconds")
+    parser.add_argument("--sink-failure-rate", type=float, default=0.0, help="share of webhooks answering 503")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the TELEGRAM_* send limits")
+    parser.add_argument(
+        "--flood-control", action="store_true", help="keep the per-user FLOOD_RATE limit (see --think-time)"
+    )
+    parser.add_argument("--niches", nargs="+", metavar="ENV_FILE", help="niche env files (default: as the bot)")
+    parser.add_argument("--db", type=Path, help="database file (default: a temporary one)")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="max wait for the outbox, seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--save-baseline", type=Path, metavar="PATH", help="write the result to PATH")
+    parser.add_argument("--compare", type=Path, metavar="PATH", help="fail on regressions against PATH")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    # Settings are read when config is imported, so they are overridden before that.
+    if not args.telegram_limits:
+        os.environ["TELEGRAM_GLOBAL_RATE"] = "1000000"
+        os.environ["TELEGRAM_CHAT_RATE"] = "1000000"
+        os.environ["TELEGRAM_CHAT_BURST"] = "1000000"
+    if not args.flood_control:
+        os.environ["FLOOD_RATE"] = "0"
+    os.environ["METRICS_PORT"] = "0"
+    logging.basicConfig(level=logging.ERROR, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    import storage
+
+    storage.DB_PATH = args.db or Path(tempfile.mkdtemp(prefix="loadtest-")) / "leads.db"
+    storage.init_db()
+    result = asyncio.run(run(args))
+
+    if args.json:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(result)
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(result, ensure_ascii=False, indent=2) + "\n")
+    if args.compare:
+        regressions = compare(result, json.loads(args.compare.read_text()), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,45 +2,43 @@ from __future__ import annotations
 
 from typing import Any
 
-from config import (
-    BUDGET_OPTIONS,
-    TIMEFRAME_OPTIONS,
-    HOT_BUDGET_MIN,
-    HOT_MAX_DAYS,
-    WARM_BUDGET_MIN,
-    WARM_MAX_DAYS,
-    LEAD_STATUS_LABELS,
-)
+from config import LEAD_STATUS_LABELS, NicheSettings
 
 
-def get_budget_option(key: str) -> dict[str, Any] | None:
-    for option in BUDGET_OPTIONS:
-        if option["key"] == key:
-            return option
-    return None
+def get_budget_option(niche: NicheSettings, key: str) -> dict[str, Any] | None:
+    return niche.budget_index.get(key)
 
 
-def get_timeframe_option(key: str) -> dict[str, Any] | None:
-    for option in TIMEFRAME_OPTIONS:
-        if option["key"] == key:
-            return option
-    return None
+def get_timeframe_option(niche: NicheSettings, key: str) -> dict[str, Any] | None:
+    return niche.timeframe_index.get(key)
 
 
-def segment_lead(budget_key: str, timeframe_key: str) -> str:
-    budget = get_budget_option(budget_key) or {"min": 0}
-    timeframe = get_timeframe_option(timeframe_key) or {"max_days": 999999}
+def segment_lead(niche: NicheSettings, budget_key: str, timeframe_key: str) -> str:
+    budget = get_budget_option(niche, budget_key) or {"min": 0}
+    timeframe = get_timeframe_option(niche, timeframe_key) or {"max_days": 999999}
 
     budget_value = int(budget.get("min") or 0)
     max_days = int(timeframe.get("max_days") or 999999)
 
-    if budget_value >= HOT_BUDGET_MIN and max_days <= HOT_MAX_DAYS:
+    if budget_value >= niche.hot_budget_min and max_days <= niche.hot_max_days:
         return "hot"
-    if budget_value >= WARM_BUDGET_MIN and max_days <= WARM_MAX_DAYS:
+    if budget_value >= niche.warm_budget_min and max_days <= niche.warm_max_days:
         return "warm"
     return "cold"
 
 
+def status_table(niche: NicheSettings) -> dict[tuple[str | None, str | None], str]:
+    """segment_lead for every (budget_key, timeframe_key) pair; None stands for a missing
+    or unknown key. Used to re-segment stored leads without evaluating the rules per row."""
+    budget_keys = [*niche.budget_index, None]
+    timeframe_keys = [*niche.timeframe_index, None]
+    return {
+        (budget_key, timeframe_key): segment_lead(niche, budget_key, timeframe_key)
+        for budget_key in budget_keys
+        for timeframe_key in timeframe_keys
+    }
+
+
 def status_label(status: str) -> str:
     return LEAD_STATUS_LABELS.get(status, status)
 
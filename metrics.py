@@ -0,0 +1,174 @@
+"""In-process counters and histograms, served in the Prometheus text format.
+
+Recording is a dict lookup and an integer increment, so it is cheap enough for the hot
+path. Nothing here imports aiohttp or aiogram until the HTTP endpoint is started, which
+keeps storage (and the admin CLI) light.
+"""
+
+from __future__ import annotations
+
+import logging
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Any, Callable
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list[Any] = []
+_runner: web.AppRunner | None = None
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple[Any, ...], float] = {}
+        _registry.append(self)
+
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: Any) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Per label set: [count per bucket (the last one is +Inf)..., sum]
+        self._values: dict[tuple[Any, ...], list[float]] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *labels: Any) -> None:
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0] * (len(self.buckets) + 2)
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, data in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), data):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {data[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """A gauge or counter kept elsewhere and read at scrape time from ``read()``, which
+    returns {label values: value}."""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], dict[tuple[Any, ...], float]],
+        labels: tuple[str, ...] = (),
+        kind: str = "gauge",
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.read = read
+        self.kind = kind
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.read()
+        except Exception:
+            logging.exception("Failed to read metric %s", self.name)
+            return []
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def start_http_server(host: str, port: int) -> None:
+    """Serve ``GET /metrics`` on host:port until stop_http_server()."""
+    global _runner
+    if _runner is not None:
+        return
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    logging.info("Metrics on http://%s:%s/metrics", host, port)
+
+
+async def stop_http_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
+
+
+# Bot
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Update handler latency", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Update handlers that raised", ("handler",))
+FORM_STEP_SECONDS = Histogram("bot_form_step_seconds", "Lead form step handler latency", ("step",))
+TELEGRAM_API_SECONDS = Histogram("telegram_api_seconds", "Bot API request latency", ("method",))
+RETURNING_USERS = Counter(
+    "bot_returning_users_total", "Users recognised mid-form and sent to the update path", ("niche", "match")
+)
+TELEGRAM_API_ERRORS = Counter("telegram_api_errors_total", "Failed Bot API requests", ("method", "error"))
+
+# Storage
+SAVE_LEAD_SECONDS = Histogram("storage_save_lead_seconds", "save_lead latency, queueing included")
+LEADS_SAVED = Counter("leads_saved_total", "Saved leads; duplicate=true for repeated phones", ("niche", "duplicate"))
+
+# Integrations
+WEBHOOK_SECONDS = Histogram("integration_webhook_seconds", "Integration webhook latency", ("sink",))
+WEBHOOK_RESPONSES = Counter(
+    "integration_webhook_responses_total",
+    "Integration webhook results: HTTP status, 'timeout' or 'error'",
+    ("sink", "status"),
+)
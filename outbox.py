@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Iterable
+
+from config import (
+    NicheSettings,
+    GOOGLE_SHEETS_BATCH_SIZE,
+    GOOGLE_SHEETS_BATCH_WINDOW_SECONDS,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_POLL_SECONDS,
+)
+from storage import (
+    PermanentDeliveryError,
+    claim_outbox,
+    complete_outbox,
+    deliver,
+    deliver_batch,
+    fail_outbox,
+    outbox_batch_ready,
+)
+
+BATCHED_SINKS = {"sheets": GOOGLE_SHEETS_BATCH_SIZE} if GOOGLE_SHEETS_BATCH_SIZE > 1 else {}
+
+_task: asyncio.Task | None = None
+_wakeup: asyncio.Event | None = None
+_niches: dict[str, NicheSettings] = {}
+
+
+def start(niches: Iterable[NicheSettings]) -> None:
+    """Deliver outbox rows of the given niches; rows of other niches are left to their own process."""
+    global _task, _wakeup
+    if _task is not None:
+        return
+    _niches.update((niche.niche_id, niche) for niche in niches)
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_run(), name="outbox-dispatcher")
+
+
+async def stop() -> None:
+    global _task, _wakeup
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
+    _wakeup = None
+    _niches.clear()
+
+
+def wake() -> None:
+    """Ask the dispatcher to drain the outbox now instead of at the next poll."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _run() -> None:
+    logging.info("Outbox dispatcher started")
+    while True:
+        try:
+            drained = await drain_once()
+        except Exception:
+            logging.exception("Outbox drain failed")
+            drained = 0
+
+        if drained >= OUTBOX_BATCH_SIZE:
+            continue
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=OUTBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+async def drain_once() -> int:
+    if not _niches:
+        return 0
+    rows = await claim_outbox(
+        _niches, OUTBOX_BATCH_SIZE, OUTBOX_LEASE_SECONDS, skip_sinks=BATCHED_SINKS
+    )
+    jobs = [_deliver_row(row) for row in rows]
+
+    claimed = len(rows)
+    for sink, size in BATCHED_SINKS.items():
+        if not await outbox_batch_ready(_niches, sink, size, GOOGLE_SHEETS_BATCH_WINDOW_SECONDS):
+            continue
+        batch = await claim_outbox(_niches, size, OUTBOX_LEASE_SECONDS, only_sink=sink)
+        claimed += len(batch)
+        # Each niche has its own spreadsheet, so a claimed batch is split per niche.
+        by_niche: dict[str, list[dict[str, Any]]] = {}
+        for row in batch:
+            by_niche.setdefault(row["niche"], []).append(row)
+        jobs.extend(_deliver_batch(sink, niche_rows) for niche_rows in by_niche.values())
+
+    await asyncio.gather(*jobs)
+    return claimed
+
+
+async def _deliver_row(row: dict[str, Any]) -> None:
+    try:
+        await deliver(_niches[row["niche"]], row["sink"], row["payload"])
+    except Exception as exc:
+        await _record_failure(row, exc)
+        return
+    await complete_outbox([row["id"]])
+
+
+async def _deliver_batch(sink: str, rows: list[dict[str, Any]]) -> None:
+    try:
+        await deliver_batch(_niches[rows[0]["niche"]], sink, [row["payload"] for row in rows])
+    except Exception as exc:
+        for row in rows:
+            await _record_failure(row, exc)
+        return
+    await complete_outbox([row["id"] for row in rows])
+
+
+async def _record_failure(row: dict[str, Any], exc: Exception) -> None:
+    permanent = isinstance(exc, PermanentDeliveryError)
+    dead = await fail_outbox(row["id"], row["attempts"], repr(exc), permanent=permanent)
+    # A sink that is down fails every row; its warnings are rate-limited together.
+    extra = {"lead_id": row["lead_id"], "rate_key": ("outbox", row["niche"], row["sink"], dead)}
+    if dead:
+        logging.error(
+            "Outbox delivery dead-lettered: id=%s lead_id=%s sink=%s error=%r",
+            row["id"],
+            row["lead_id"],
+            row["sink"],
+            exc,
+            extra=extra,
+        )
+    else:
+        logging.warning(
+            "Outbox delivery failed, will retry: id=%s sink=%s attempt=%s error=%r",
+            row["id"],
+            row["sink"],
+            row["attempts"],
+            exc,
+            extra=extra,
+        )
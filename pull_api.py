@@ -0,0 +1,115 @@
+"""Read-only HTTP API a CRM polls to pick up new and changed leads:
+
+    GET /leads?since=<cursor>&limit=1000&niche=<NICHE_ID>
+    Authorization: Bearer <PULL_API_TOKEN>
+
+The response is NDJSON, one lead per line, ordered by (updated_at, id). Every line carries
+the ``cursor`` to send as ``since`` to continue right after that lead, so a client that
+lost the connection mid-response resumes from the last complete line. Fewer lines than
+``limit`` means the client is caught up. Without ``since`` the listing starts from the
+oldest lead; archived leads (python -m cli archive) are not served.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import hmac
+import json
+import logging
+
+from aiohttp import web
+
+from config import EXPORT_CHUNK_SIZE, PULL_API_MAX_LIMIT, PULL_API_TOKEN
+from storage import leads_changed_since
+
+DEFAULT_LIMIT = 1000
+# Leads changed this recently wait for the next poll; see storage.leads_changed_since.
+SETTLE_SECONDS = 2
+
+_runner: web.AppRunner | None = None
+
+
+def encode_cursor(updated_at: str, lead_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{updated_at}|{lead_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        updated_at, lead_id = raw.rsplit("|", 1)
+        return updated_at, int(lead_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor!r}") from None
+
+
+def _bad_request(message: str) -> web.Response:
+    return web.json_response({"error": message}, status=400)
+
+
+async def handle_leads(request: web.Request) -> web.StreamResponse:
+    if PULL_API_TOKEN:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied.encode(), PULL_API_TOKEN.encode()):
+            return web.json_response({"error": "unauthorized"}, status=401)
+
+    query = request.query
+    try:
+        after = decode_cursor(query["since"]) if query.get("since") else None
+    except ValueError as exc:
+        return _bad_request(str(exc))
+    try:
+        limit = int(query.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        return _bad_request("limit must be an integer")
+    if not 1 <= limit <= PULL_API_MAX_LIMIT:
+        return _bad_request(f"limit must be between 1 and {PULL_API_MAX_LIMIT}")
+    niche_id = query.get("niche") or None
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+    await response.prepare(request)
+    remaining = limit
+    while remaining:
+        # Page by page, each a separate keyset query, so a large limit never holds more
+        # than one page in memory or a reader connection for the whole response.
+        page = min(remaining, EXPORT_CHUNK_SIZE)
+        rows = await leads_changed_since(niche_id, after, page, SETTLE_SECONDS)
+        if not rows:
+            break
+        lines = []
+        for row in rows:
+            row["cursor"] = encode_cursor(row["updated_at"], row["id"])
+            lines.append(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+        await response.write(("\n".join(lines) + "\n").encode())
+        remaining -= len(rows)
+        after = (rows[-1]["updated_at"], rows[-1]["id"])
+        if len(rows) < page:
+            break
+    await response.write_eof()
+    return response
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/leads", handle_leads)
+    return app
+
+
+async def start_http_server(host: str, port: int) -> None:
+    """Serve the pull API on host:port until stop_http_server()."""
+    global _runner
+    if _runner is not None:
+        return
+    if not PULL_API_TOKEN and host not in ("127.0.0.1", "localhost", "::1"):
+        logging.warning("Pull API on %s without PULL_API_TOKEN: leads are readable by anyone", host)
+    _runner = web.AppRunner(create_app(), access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    logging.info("Pull API on http://%s:%s/leads", host, port)
+
+
+async def stop_http_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,90 @@
+"""Read-only queries that need nothing but sqlite3, so ``python -m cli stats`` can answer
+straight from the database file without the storage engine, asyncio or the delivery
+modules. storage runs the same functions on its reader connections.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from datetime import date
+from pathlib import Path
+from typing import Any
+
+DB_PATH = Path(__file__).with_name("leads.db")
+# The schema version (PRAGMA user_version) these queries are written for; storage checks
+# it against its migrations.
+SCHEMA_VERSION = 13
+
+STATS_DIMENSIONS = {
+    "day": "day",
+    "budget": "budget_key",
+    "timeframe": "timeframe_key",
+    "region": "region",
+}
+
+
+def open_current(path: Path = DB_PATH) -> sqlite3.Connection | None:
+    """A read-only connection to ``path``, or None if the file is missing or has
+    migrations pending (storage.init_db applies them)."""
+    if not path.exists():
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=5000")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        conn.close()
+        return None
+    return conn
+
+
+def stats(
+    conn: sqlite3.Connection,
+    niche_id: str | None,
+    start: date | None,
+    end: date | None,
+    dimension: str | None,
+) -> dict[str, Any]:
+    """Lead counts from lead_rollups; cost grows with the number of days, not leads.
+
+    ``niche_id=None`` counts every niche stored in the database.
+    """
+    where = "day BETWEEN ? AND ?"
+    params = [
+        start.isoformat() if start else "0000-00-00",
+        end.isoformat() if end else "9999-99-99",
+    ]
+    if niche_id is not None:
+        where += " AND niche=?"
+        params.append(niche_id)
+
+    result: dict[str, Any] = {"total": 0, "hot": 0, "warm": 0, "cold": 0}
+    rows = conn.execute(
+        f"SELECT status, SUM(count) AS c FROM lead_rollups WHERE {where} GROUP BY status",
+        params,
+    ).fetchall()
+    for row in rows:
+        result["total"] += row["c"]
+        if row["status"] in result:
+            result[row["status"]] = row["c"]
+
+    if dimension:
+        column = STATS_DIMENSIONS[dimension]
+        breakdown: dict[str, dict[str, int]] = {}
+        rows = conn.execute(
+            f"""
+            SELECT {column} AS value, status, SUM(count) AS c
+            FROM lead_rollups
+            WHERE {where}
+            GROUP BY {column}, status
+            ORDER BY {column}
+            """,
+            params,
+        ).fetchall()
+        for row in rows:
+            bucket = breakdown.setdefault(row["value"], {"total": 0, "hot": 0, "warm": 0, "cold": 0})
+            bucket["total"] += row["c"]
+            if row["status"] in bucket:
+                bucket[row["status"]] = row["c"]
+        result["breakdown"] = breakdown
+
+    return result
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens per second, bursts of up to ``capacity``.
+
+    Tokens are reserved up front (the balance may go negative), so concurrent callers
+    are served in arrival order without polling.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take ``tokens`` and return how many seconds to wait before using them."""
+        self._refill()
+        self.tokens -= tokens
+        return max(0.0, -self.tokens / self.rate)
+
+    def try_take(self, tokens: float = 1) -> bool:
+        """Take ``tokens`` if they are available now; never goes into debt."""
+        self._refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated_at) * self.rate >= self.capacity
+
+    async def acquire(self, tokens: float = 1) -> float:
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def pause(self, seconds: float) -> None:
+        """Push every future reservation back by ``seconds`` (e.g. after a 429 RetryAfter)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class KeyedTokenBuckets:
+    """One TokenBucket per key, at most ``max_keys`` of them (least recently used go first).
+
+    Buckets that have refilled completely are dropped as well: a fresh bucket behaves the
+    same, so idle keys cost no memory.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+
+    def get(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._expire()
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if not oldest.is_full(now):
+                break
+            self._buckets.popitem(last=False)
+
+    async def acquire(self, key: Hashable, tokens: float = 1) -> float:
+        return await self.get(key).acquire(tokens)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+
+from app_logging import setup_logging
+from config import NICHE_ENV_FILES, RESEGMENT_CHUNK_SIZE, NicheSettings, load_niches
+from logic import status_table
+from storage import (
+    clear_resegment_checkpoints,
+    close_engine,
+    init_db,
+    resegment_checkpoint,
+    resegment_chunk,
+)
+
+
+def rules_fingerprint(table: dict) -> str:
+    """Identifies a rule set, so a checkpoint is only resumed with the rules it was made with."""
+    items = sorted((budget or "", timeframe or "", status) for (budget, timeframe), status in table.items())
+    return hashlib.sha1(json.dumps(items).encode()).hexdigest()[:16]
+
+
+async def resegment(
+    niche: NicheSettings,
+    chunk_size: int = RESEGMENT_CHUNK_SIZE,
+    dry_run: bool = False,
+    push_crm: bool = False,
+    restart: bool = False,
+) -> dict[tuple[str, str], int]:
+    """Recompute the status of every stored lead of ``niche`` with its current rules.
+
+    Returns counts of (old status, new status) transitions. A dry run changes nothing.
+    Otherwise each chunk is committed with a checkpoint, and an interrupted run continues
+    where it stopped unless ``restart`` is set or the rules have changed since.
+    """
+    table = status_table(niche)
+    rules = rules_fingerprint(table)
+    after_id = 0
+    if not dry_run:
+        if restart:
+            await clear_resegment_checkpoints(niche.niche_id)
+        after_id, changed = await resegment_checkpoint(niche.niche_id, rules)
+        if after_id:
+            logging.info(
+                "Resegment %s: resuming after lead %s (%s changed before)", niche.niche_id, after_id, changed
+            )
+
+    diff: dict[tuple[str, str], int] = {}
+    while True:
+        last_id, chunk_diff = await resegment_chunk(
+            niche, table, rules, after_id, chunk_size, dry_run=dry_run, push_crm=push_crm
+        )
+        if last_id is None:
+            break
+        for transition, count in chunk_diff.items():
+            diff[transition] = diff.get(transition, 0) + count
+        after_id = last_id
+        logging.info("Resegment %s: up to lead %s, %s changed", niche.niche_id, after_id, sum(diff.values()))
+
+    if not dry_run:
+        await clear_resegment_checkpoints(niche.niche_id)
+    return diff
+
+
+async def run(niches: list[NicheSettings], chunk_size: int, dry_run: bool, push_crm: bool, restart: bool) -> None:
+    for niche in niches:
+        diff = await resegment(niche, chunk_size, dry_run=dry_run, push_crm=push_crm, restart=restart)
+        suffix = " (dry run, nothing written)" if dry_run else ""
+        print(f"{niche.niche_id}: {sum(diff.values())} leads change status{suffix}")
+        for (old, new), count in sorted(diff.items()):
+            print(f"  {old or '-'} -> {new}: {count}")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m cli resegment",
+        description="Recompute lead statuses after changing segmentation rules",
+    )
+    parser.add_argument(
+        "--niches",
+        nargs="+",
+        default=NICHE_ENV_FILES,
+        metavar="ENV_FILE",
+        help="env files of the niches to process (default: NICHE_ENV_FILES or ENV_FILE)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only count the status changes")
+    parser.add_argument(
+        "--push-crm", action="store_true", help="send leads whose status changed to the CRM again"
+    )
+    parser.add_argument("--restart", action="store_true", help="ignore a saved checkpoint")
+    parser.add_argument("--chunk-size", type=int, default=RESEGMENT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    init_db()
+    try:
+        asyncio.run(run(load_niches(args.niches), args.chunk_size, args.dry_run, args.push_crm, args.restart))
+    finally:
+        close_engine()
+
+
+if __name__ == "__main__":
+    main()
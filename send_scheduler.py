@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import time
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    SendAnimation,
+    SendAudio,
+    SendDocument,
+    SendMediaGroup,
+    SendPhoto,
+    SendVideo,
+    SendVoice,
+    TelegramMethod,
+)
+from aiogram.methods.base import Response, TelegramType
+
+import metrics as app_metrics
+from ratelimit import KeyedTokenBuckets, TokenBucket
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+    DOCUMENT = 2
+
+
+# File uploads are slow and rarely urgent, so they never overtake text replies.
+_DOCUMENT_METHODS = (
+    SendAnimation,
+    SendAudio,
+    SendDocument,
+    SendMediaGroup,
+    SendPhoto,
+    SendVideo,
+    SendVoice,
+)
+
+_send_priority: ContextVar[Priority] = ContextVar("send_priority", default=Priority.INTERACTIVE)
+_schedulers: weakref.WeakSet[SendScheduler] = weakref.WeakSet()
+
+
+@contextmanager
+def send_priority(priority: Priority) -> Iterator[None]:
+    """Run Bot API calls made inside the block (and tasks started from it) at ``priority``."""
+    token = _send_priority.set(priority)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
+
+@dataclass(order=True)
+class _Job:
+    priority: Priority
+    seq: int
+    chat_id: Any = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+    chat_reserved: bool = field(compare=False, default=False)
+
+
+@dataclass
+class _WaitStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Session middleware that paces a bot's outgoing chat messages.
+
+    Calls addressed to a chat wait in a priority queue (interactive replies first, then
+    admin notifications, then documents) and are released by one worker under a global
+    and a per-chat token bucket. A 429 RetryAfter pauses the whole bot and the call is
+    retried up to ``max_retries`` times. Calls without a chat (getUpdates, answerCallbackQuery,
+    ...) bypass the queue.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int) -> None:
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets = KeyedTokenBuckets(chat_rate, chat_burst)
+        self.max_retries = max_retries
+        self.queue_depth = {priority: 0 for priority in Priority}
+        self.wait_stats = {priority: _WaitStats() for priority in Priority}
+        self.retries = 0
+        self._seq = itertools.count()
+        self._queue: asyncio.PriorityQueue[_Job] | None = None
+        self._worker: asyncio.Task | None = None
+        _schedulers.add(self)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = _send_priority.get()
+        if isinstance(method, _DOCUMENT_METHODS):
+            priority = max(priority, Priority.DOCUMENT)
+
+        attempt = 0
+        while True:
+            await self._wait_turn(priority, chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                logging.warning("Bot API flood control, pausing sends for %ss", exc.retry_after)
+                self.global_bucket.pause(exc.retry_after)
+
+    async def _wait_turn(self, priority: Priority, chat_id: Any) -> None:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._worker = asyncio.create_task(self._run(), name="send-scheduler")
+        job = _Job(priority, next(self._seq), chat_id, asyncio.get_running_loop().create_future())
+        self.queue_depth[priority] += 1
+        self._queue.put_nowait(job)
+        await job.future
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            if job.future.done():
+                # The caller was cancelled while queued.
+                self.queue_depth[job.priority] -= 1
+                continue
+            if not job.chat_reserved:
+                job.chat_reserved = True
+                delay = self.chat_buckets.get(job.chat_id).reserve()
+                if delay:
+                    # Park the job instead of blocking the queue; other chats go meanwhile.
+                    loop.call_later(delay, self._queue.put_nowait, job)
+                    continue
+            await self.global_bucket.acquire()
+            self.queue_depth[job.priority] -= 1
+            if not job.future.done():
+                self.wait_stats[job.priority].add(time.monotonic() - job.enqueued_at)
+                job.future.set_result(None)
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._queue.get_nowait().future.cancel()
+        self._worker = None
+        self._queue = None
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "queue_depth": {priority.name.lower(): depth for priority, depth in self.queue_depth.items()},
+            "wait_seconds": {
+                priority.name.lower(): {"count": stats.count, "sum": stats.total, "max": stats.max}
+                for priority, stats in self.wait_stats.items()
+            },
+            "retries": self.retries,
+        }
+
+
+def metrics() -> dict[str, Any]:
+    """Queue depth and wait time per priority, summed over the schedulers of all bots."""
+    result: dict[str, Any] = {
+        "queue_depth": {priority.name.lower(): 0 for priority in Priority},
+        "wait_seconds": {
+            priority.name.lower(): {"count": 0, "sum": 0.0, "max": 0.0} for priority in Priority
+        },
+        "retries": 0,
+    }
+    for scheduler in list(_schedulers):
+        data = scheduler.metrics()
+        result["retries"] += data["retries"]
+        for name, depth in data["queue_depth"].items():
+            result["queue_depth"][name] += depth
+        for name, stats in data["wait_seconds"].items():
+            total = result["wait_seconds"][name]
+            total["count"] += stats["count"]
+            total["sum"] += stats["sum"]
+            total["max"] = max(total["max"], stats["max"])
+    return result
+
+
+def _read_queue_depth() -> dict[tuple[Any, ...], float]:
+    return {(name,): depth for name, depth in metrics()["queue_depth"].items()}
+
+
+def _read_wait_seconds() -> dict[tuple[Any, ...], float]:
+    return {(name,): stats["sum"] for name, stats in metrics()["wait_seconds"].items()}
+
+
+def _read_released() -> dict[tuple[Any, ...], float]:
+    return {(name,): stats["count"] for name, stats in metrics()["wait_seconds"].items()}
+
+
+app_metrics.CallbackMetric(
+    "telegram_send_queue_depth",
+    "Bot API calls waiting in the send scheduler",
+    _read_queue_depth,
+    ("priority",),
+)
+app_metrics.CallbackMetric(
+    "telegram_send_wait_seconds_total",
+    "Time calls spent waiting in the send scheduler",
+    _read_wait_seconds,
+    ("priority",),
+    kind="counter",
+)
+app_metrics.CallbackMetric(
+    "telegram_send_released_total",
+    "Calls released by the send scheduler",
+    _read_released,
+    ("priority",),
+    kind="counter",
+)
+
+
+async def close_all() -> None:
+    for scheduler in list(_schedulers):
+        await scheduler.close()
@@ -0,0 +1,311 @@
+"""Sharded update processing: the main process receives updates (long polling or webhook)
+and hands each one to one of N worker processes, picked by chat id, so CPU-bound handler
+work spreads over cores. Every worker runs its own Dispatcher with the usual middlewares
+and router; all of them share the SQLite database.
+
+A chat always goes to the same worker, which handles its updates one at a time in the order
+they were received, so per-user state kept in memory (FSM cache, flood control, the lead
+index) stays consistent. What must run once stays in the main process: the outbox with its
+sinks and the pull API. Leads saved by workers are delivered on the next outbox poll
+(OUTBOX_POLL_SECONDS) rather than immediately.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import hmac
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiohttp import web
+
+import metrics
+from app_logging import setup_logging, stop_logging
+from bot import create_bot, create_dispatcher, router, start_delivery, stop_delivery
+from config import (
+    METRICS_HOST,
+    METRICS_PORT,
+    NicheSettings,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_WEBHOOK_HOST,
+    TELEGRAM_WEBHOOK_PORT,
+    TELEGRAM_WEBHOOK_SECRET,
+    WORKER_MAX_CONCURRENCY,
+    WORKER_QUEUE_SIZE,
+)
+from storage import close_engine, init_db
+from webhook_server import set_webhooks, webhook_path
+
+POLLING_TIMEOUT = 10
+WATCH_SECONDS = 1.0
+
+_STOP = None
+
+
+def chat_key(update: dict[str, Any]) -> int:
+    """The chat of a raw update, or its sender when it has no chat; 0 when it has neither."""
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+class ShardPool:
+    """Worker processes, each fed by its own bounded queue of raw updates.
+
+    route() waits while the chat's queue is full, which in turn holds back polling (or the
+    webhook response). A worker that dies is restarted on the same queue; the updates it
+    was handling at the time are lost.
+    """
+
+    def __init__(
+        self,
+        niches: list[NicheSettings],
+        workers: int,
+        queue_size: int = WORKER_QUEUE_SIZE,
+        session_factory: Callable[[], BaseSession] | None = None,
+    ) -> None:
+        if workers < 1:
+            raise ValueError("ShardPool needs at least one worker")
+        # Spawn, not fork: the parent already runs the storage engine's threads.
+        self._context = multiprocessing.get_context("spawn")
+        self.niches = niches
+        self.workers = workers
+        self.session_factory = session_factory
+        self._queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self._locks = [asyncio.Lock() for _ in range(workers)]
+        self._processes: list[BaseProcess] = []
+        self._watchdog: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._processes = [self._spawn(index) for index in range(self.workers)]
+        self._watchdog = asyncio.create_task(self._watch())
+
+    async def route(self, bot_id: int, update: dict[str, Any]) -> None:
+        index = chat_key(update) % self.workers
+        item = (bot_id, update)
+        # The lock keeps arrival order while a put has to wait for room in the queue.
+        async with self._locks[index]:
+            try:
+                self._queues[index].put_nowait(item)
+            except queue.Full:
+                await asyncio.to_thread(self._queues[index].put, item)
+
+    async def stop(self) -> None:
+        """Let every worker finish what is queued, then wait for it to exit."""
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._watchdog
+            self._watchdog = None
+        for updates in self._queues:
+            await asyncio.to_thread(updates.put, _STOP)
+        for process in self._processes:
+            await asyncio.to_thread(process.join)
+
+    def _spawn(self, index: int) -> BaseProcess:
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.workers, self.niches, self._queues[index], self.session_factory),
+            name=f"lead-bot-shard-{index}",
+        )
+        process.start()
+        return process
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(WATCH_SECONDS)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logging.error("Shard %s exited with code %s, restarting it", index, process.exitcode)
+                    self._processes[index] = self._spawn(index)
+
+
+def _worker_main(
+    index: int,
+    workers: int,
+    niches: list[NicheSettings],
+    updates: multiprocessing.Queue,
+    session_factory: Callable[[], BaseSession] | None,
+) -> None:
+    # Ctrl+C reaches the whole process group; workers stop when the main process says so,
+    # after finishing what is queued.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging()
+    try:
+        asyncio.run(_Worker(index, workers, niches, updates, session_factory).run())
+    finally:
+        stop_logging()
+
+
+class _Worker:
+    def __init__(
+        self,
+        index: int,
+        workers: int,
+        niches: list[NicheSettings],
+        updates: multiprocessing.Queue,
+        session_factory: Callable[[], BaseSession] | None,
+    ) -> None:
+        self.updates = updates
+        # Every process schedules its own sends, so each gets a share of the global limit.
+        bots = [
+            create_bot(
+                niche,
+                session=session_factory() if session_factory else None,
+                global_rate=TELEGRAM_GLOBAL_RATE / workers,
+            )
+            for niche in niches
+        ]
+        self.bots = {bot.id: bot for bot in bots}
+        self.dp = create_dispatcher({bot.id: niche for bot, niche in zip(bots, niches)}, shard=index)
+        self._slots = threading.BoundedSemaphore(WORKER_MAX_CONCURRENCY)
+        # chat -> the last task started for it; the next one waits for it to finish
+        self._tails: dict[int, asyncio.Task] = {}
+
+    async def run(self) -> None:
+        bots = list(self.bots.values())
+        workflow_data = {"bots": bots, "dispatcher": self.dp, **self.dp.workflow_data}
+        await self.dp.emit_startup(bot=bots[-1], **workflow_data)
+        stopped = asyncio.Event()
+        threading.Thread(
+            target=self._receive,
+            args=(asyncio.get_running_loop(), stopped),
+            name="shard-receiver",
+            daemon=True,
+        ).start()
+        try:
+            await stopped.wait()
+            while self._tails:
+                await asyncio.wait(list(self._tails.values()))
+        finally:
+            await self.dp.emit_shutdown(bot=bots[-1], **workflow_data)
+            for bot in bots:
+                await bot.session.close()
+
+    def _receive(self, loop: asyncio.AbstractEventLoop, stopped: asyncio.Event) -> None:
+        # A blocking get() off the event loop; a free slot is taken first, so at most
+        # WORKER_MAX_CONCURRENCY updates are in progress and the rest wait in the queue.
+        while True:
+            self._slots.acquire()
+            item = self.updates.get()
+            if item is _STOP:
+                loop.call_soon_threadsafe(stopped.set)
+                return
+            loop.call_soon_threadsafe(self._start, *item)
+
+    def _start(self, bot_id: int, update: dict[str, Any]) -> None:
+        key = chat_key(update)
+        task = asyncio.create_task(self._process(self.bots[bot_id], update, self._tails.get(key)))
+        self._tails[key] = task
+        task.add_done_callback(functools.partial(self._finished, key))
+
+    async def _process(self, bot: Bot, update: dict[str, Any], previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.dp.feed_raw_update(bot, update)
+        except Exception:
+            logging.exception("Failed to process update %s", update.get("update_id"))
+
+    def _finished(self, key: int, task: asyncio.Task) -> None:
+        if self._tails.get(key) is task:
+            del self._tails[key]
+        self._slots.release()
+
+
+async def _poll_bot(bot: Bot, pool: ShardPool, allowed_updates: list[str]) -> None:
+    offset = None
+    backoff = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates
+            )
+        except Exception as exc:
+            logging.warning("getUpdates failed (%s), retrying in %.0fs", exc, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+            continue
+        backoff = 1.0
+        for update in updates:
+            await pool.route(bot.id, update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+async def _poll(bots: list[Bot], pool: ShardPool) -> None:
+    # getUpdates is rejected while a webhook is registered, e.g. after running in webhook mode.
+    for bot in bots:
+        await bot.delete_webhook()
+    logging.info("Lead bot started (long polling, %s niche(s), %s shards)", len(bots), pool.workers)
+    allowed_updates = router.resolve_used_update_types()
+    await asyncio.gather(*(_poll_bot(bot, pool, allowed_updates) for bot in bots))
+
+
+async def _serve_webhook(bots: list[Bot], pool: ShardPool) -> None:
+    def handler(bot: Bot) -> Callable[[web.Request], Any]:
+        async def handle(request: web.Request) -> web.Response:
+            secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if TELEGRAM_WEBHOOK_SECRET and not hmac.compare_digest(secret, TELEGRAM_WEBHOOK_SECRET):
+                return web.Response(status=401)
+            await pool.route(bot.id, await request.json())
+            return web.json_response({})
+
+        return handle
+
+    app = web.Application()
+    for bot in bots:
+        app.router.add_post(webhook_path(bot, bots), handler(bot))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, TELEGRAM_WEBHOOK_HOST, TELEGRAM_WEBHOOK_PORT).start()
+    try:
+        await set_webhooks(bots, router.resolve_used_update_types())
+        logging.info(
+            "Lead bot started (webhook on %s:%s, %s niche(s), %s shards)",
+            TELEGRAM_WEBHOOK_HOST,
+            TELEGRAM_WEBHOOK_PORT,
+            len(bots),
+            pool.workers,
+        )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_sharded(niches: list[NicheSettings], mode: str, workers: int) -> None:
+    setup_logging()
+    init_db()
+    bots = [create_bot(niche) for niche in niches]
+    pool = ShardPool(niches, workers)
+    pool.start()
+    await start_delivery(niches)
+    if METRICS_PORT:
+        await metrics.start_http_server(METRICS_HOST, METRICS_PORT)
+    try:
+        if mode == "webhook":
+            await _serve_webhook(bots, pool)
+        else:
+            await _poll(bots, pool)
+    finally:
+        await pool.stop()
+        await metrics.stop_http_server()
+        await stop_delivery()
+        for bot in bots:
+            await bot.session.close()
+        close_engine()
@@ -1,169 +1,1110 @@
 from __future__ import annotations
 
+import asyncio
 import csv
+import gzip
+import heapq
+import io
 import json
 import logging
+import random
 import sqlite3
-from contextlib import contextmanager
-from datetime import date
+import time
+import zipfile
+from contextlib import closing, contextmanager
+from datetime import date, timedelta
 from pathlib import Path
-from typing import Any, Iterable
-
-import httpx
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, TextIO
 
+import archive
+import csv_sink
+import metrics
+import queries
+from db import StorageEngine, connect
+from queries import DB_PATH, STATS_DIMENSIONS
 from config import (
-    CRM_WEBHOOK_URL,
-    GOOGLE_SHEETS_WEBHOOK_URL,
-    GOOGLE_SHEETS_CSV_PATH,
+    NICHE,
+    NicheSettings,
     WEBHOOK_TIMEOUT_SECONDS,
-    NICHE_NAME,
+    CRM_TIMEOUT_SECONDS,
+    GOOGLE_SHEETS_TIMEOUT_SECONDS,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    HTTP2_ENABLED,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BASE_SECONDS,
+    OUTBOX_RETRY_MAX_SECONDS,
+    DB_READ_POOL_SIZE,
+    DB_GROUP_COMMIT_MAX,
+    DB_SYNCHRONOUS,
+    EXPORT_CHUNK_SIZE,
+    ARCHIVE_DIR,
+    ARCHIVE_BATCH_SIZE,
 )
 
-DB_PATH = Path(__file__).with_name("leads.db")
+if TYPE_CHECKING:
+    # httpx is slow to import and only needed for delivery; admin tools skip it.
+    import httpx
+
+_engine: StorageEngine | None = None
+_http_client: httpx.AsyncClient | None = None
+
+
+def get_engine() -> StorageEngine:
+    global _engine
+    if _engine is None:
+        _engine = StorageEngine(
+            DB_PATH,
+            read_pool_size=DB_READ_POOL_SIZE,
+            group_commit_max=DB_GROUP_COMMIT_MAX,
+            synchronous=DB_SYNCHRONOUS,
+        )
+    return _engine
+
+
+def archive_dir() -> Path:
+    return Path(ARCHIVE_DIR) if ARCHIVE_DIR else DB_PATH.with_name("archive")
+
+
+def close_engine() -> None:
+    global _engine
+    if _engine is None:
+        return
+    engine, _engine = _engine, None
+    engine.close()
 
 
 def init_db() -> None:
-    with get_conn() as conn:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS leads (
-                id INTEGER PRIMARY KEY,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                name TEXT,
-                phone TEXT UNIQUE NOT NULL,
-                email TEXT,
-                budget_key TEXT,
-                budget_label TEXT,
-                region TEXT,
-                timeframe_key TEXT,
-                timeframe_label TEXT,
-                contacted_before TEXT,
-                status TEXT,
-                duplicate_count INTEGER DEFAULT 0,
-                raw_payload TEXT
-            );
-            """
+    get_engine().submit_write(_migrate).result()
+    # Left over if the last process stopped between a commit and its archive changes.
+    apply_archive_changes()
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Apply pending MIGRATIONS in order; PRAGMA user_version records the last applied one."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logging.info("Applying DB migration %s: %s", number, migration.__name__)
+        migration(conn)
+        conn.execute(f"PRAGMA user_version={number}")
+    # Refresh stale planner statistics; 0x10002 also checks tables this fresh connection
+    # has not queried yet. (Before SQLite 3.46 tables never analyzed are left alone.)
+    conn.execute("PRAGMA optimize=0x10002")
+
+
+def _m001_initial(conn: sqlite3.Connection) -> None:
+    # IF NOT EXISTS lets databases created before migrations were introduced adopt version 1.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leads (
+            id INTEGER PRIMARY KEY,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            name TEXT,
+            phone TEXT UNIQUE NOT NULL,
+            email TEXT,
+            budget_key TEXT,
+            budget_label TEXT,
+            region TEXT,
+            timeframe_key TEXT,
+            timeframe_label TEXT,
+            contacted_before TEXT,
+            status TEXT,
+            duplicate_count INTEGER DEFAULT 0,
+            raw_payload TEXT
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            lead_id INTEGER,
+            sink TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, next_attempt_at)"
+    )
+
+
+def _m002_lead_indexes(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leads_status ON leads (status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leads_updated_at ON leads (updated_at)")
+
+
+def _create_rollups(conn: sqlite3.Connection, dimensions: list[str]) -> None:
+    """Create and backfill lead_rollups keyed by day plus ``dimensions``, kept current by triggers."""
+    key = ", ".join(["day", *dimensions])
+
+    def values(row: str) -> str:
+        # NULLs would defeat the primary key, so missing dimensions are stored as ''.
+        columns = [f"date({row}.created_at)"]
+        columns.extend(f"COALESCE({row}.{column}, '')" for column in dimensions)
+        return ", ".join(columns)
+
+    changed = " OR ".join(
+        ["date(OLD.created_at) IS NOT date(NEW.created_at)"]
+        + [f"OLD.{column} IS NOT NEW.{column}" for column in dimensions]
+    )
+    columns_sql = "".join(f"{column} TEXT NOT NULL, " for column in dimensions)
+
+    conn.execute(
+        f"""
+        CREATE TABLE lead_rollups (
+            day TEXT NOT NULL,
+            {columns_sql}
+            count INTEGER NOT NULL,
+            PRIMARY KEY ({key})
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        f"""
+        INSERT INTO lead_rollups ({key}, count)
+        SELECT {values("leads")}, COUNT(*)
+        FROM leads
+        GROUP BY {", ".join(str(i) for i in range(1, len(dimensions) + 2))}
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER leads_rollup_insert AFTER INSERT ON leads
+        BEGIN
+            INSERT INTO lead_rollups ({key}, count)
+            VALUES ({values("NEW")}, 1)
+            ON CONFLICT ({key}) DO UPDATE SET count=count+1;
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER leads_rollup_update
+        AFTER UPDATE OF created_at, {", ".join(dimensions)} ON leads
+        WHEN {changed}
+        BEGIN
+            UPDATE lead_rollups SET count=count-1
+            WHERE ({key}) = ({values("OLD")});
+            DELETE FROM lead_rollups
+            WHERE ({key}) = ({values("OLD")}) AND count<=0;
+            INSERT INTO lead_rollups ({key}, count)
+            VALUES ({values("NEW")}, 1)
+            ON CONFLICT ({key}) DO UPDATE SET count=count+1;
+        END
+        """
+    )
+
+
+def _m003_stats_rollups(conn: sqlite3.Connection) -> None:
+    _create_rollups(conn, ["status", "budget_key", "timeframe_key", "region"])
+
+
+def _m004_fsm_state(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX idx_fsm_state_updated_at ON fsm_state (updated_at)")
+
+
+def _m005_niches(conn: sqlite3.Connection) -> None:
+    # Phones become unique per niche, which needs a table rebuild. Existing rows are
+    # attributed to the niche of the process that runs the migration.
+    conn.execute(
+        """
+        CREATE TABLE leads_new (
+            id INTEGER PRIMARY KEY,
+            niche TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            name TEXT,
+            phone TEXT NOT NULL,
+            email TEXT,
+            budget_key TEXT,
+            budget_label TEXT,
+            region TEXT,
+            timeframe_key TEXT,
+            timeframe_label TEXT,
+            contacted_before TEXT,
+            status TEXT,
+            duplicate_count INTEGER DEFAULT 0,
+            raw_payload TEXT,
+            UNIQUE (niche, phone)
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO leads_new (
+            id, niche, created_at, updated_at, name, phone, email, budget_key, budget_label,
+            region, timeframe_key, timeframe_label, contacted_before, status, duplicate_count,
+            raw_payload
+        )
+        SELECT
+            id, ?, created_at, updated_at, name, phone, email, budget_key, budget_label,
+            region, timeframe_key, timeframe_label, contacted_before, status, duplicate_count,
+            raw_payload
+        FROM leads
+        """,
+        (NICHE.niche_id,),
+    )
+    conn.execute("DROP TABLE lead_rollups")
+    conn.execute("DROP TABLE leads")
+    conn.execute("ALTER TABLE leads_new RENAME TO leads")
+    _m002_lead_indexes(conn)
+    _create_rollups(conn, ["niche", "status", "budget_key", "timeframe_key", "region"])
+
+    conn.execute("ALTER TABLE outbox ADD COLUMN niche TEXT NOT NULL DEFAULT ''")
+    conn.execute("UPDATE outbox SET niche=?", (NICHE.niche_id,))
+
+
+def _m006_resegment_checkpoints(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE resegment_checkpoints (
+            niche TEXT NOT NULL,
+            rules TEXT NOT NULL,
+            last_id INTEGER NOT NULL,
+            changed INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (niche, rules)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _m007_funnel(conn: sqlite3.Connection) -> None:
+    # Rowid table with integer time and event codes: ~30 bytes per event.
+    conn.execute(
+        """
+        CREATE TABLE funnel_events (
+            ts INTEGER NOT NULL,
+            niche TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            step TEXT NOT NULL,
+            event INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE funnel_rollups (
+            day TEXT NOT NULL,
+            niche TEXT NOT NULL,
+            step TEXT NOT NULL,
+            event INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (niche, day, step, event)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _m008_lead_email_index(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE INDEX idx_leads_niche_email ON leads (niche, email COLLATE NOCASE)")
+
+
+def _m009_lead_changes_index(conn: sqlite3.Connection) -> None:
+    # Index entries end with the rowid (= id), so this and idx_leads_updated_at both serve
+    # ORDER BY updated_at, id for one niche and for all of them.
+    conn.execute("CREATE INDEX idx_leads_niche_updated_at ON leads (niche, updated_at)")
+
+
+def _m010_lead_niche_created_index(conn: sqlite3.Connection) -> None:
+    # Per-niche exports filter on niche and stream in created_at order straight off this
+    # index; without it SQLite scans the whole niche and sorts it in memory.
+    conn.execute("CREATE INDEX idx_leads_niche_created_at ON leads (niche, created_at)")
+
+
+def _m011_stable_niche_id(conn: sqlite3.Connection) -> None:
+    # NICHE_ID used to default to NICHE_NAME, so m005 may have tagged existing rows with
+    # the display name. Move them to the niche's id (now "default" when NICHE_ID is unset)
+    # unless that id already has data of its own.
+    if NICHE.niche_name != NICHE.niche_id and not _niche_has_data(conn, NICHE.niche_id):
+        _rename_niche(conn, NICHE.niche_name, NICHE.niche_id)
+
+
+def _m012_archived_leads(conn: sqlite3.Connection) -> None:
+    # What is left of an archived lead in the main database: enough to recognise a
+    # returning user and to never hand its id to a new lead.
+    conn.execute(
+        """
+        CREATE TABLE archived_leads (
+            id INTEGER PRIMARY KEY,
+            niche TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            email TEXT,
+            month TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE UNIQUE INDEX idx_archived_leads_niche_phone ON archived_leads (niche, phone)")
+    conn.execute("CREATE INDEX idx_archived_leads_niche_email ON archived_leads (niche, email COLLATE NOCASE)")
+    for path in archive.archive_files(archive_dir(), None, None):
+        with closing(sqlite3.connect(path)) as db:
+            db.row_factory = sqlite3.Row
+            rows = db.execute("SELECT id, niche, phone, email, created_at FROM leads ORDER BY id").fetchall()
+        conn.executemany(
+            "INSERT OR REPLACE INTO archived_leads (id, niche, phone, email, month) VALUES (?,?,?,?,?)",
+            [(row["id"], row["niche"], row["phone"], row["email"], row["created_at"][:7]) for row in rows],
+        )
+    # m011 may have queued a niche move of the archive files in this same run, so the
+    # files still hold the old id.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='archive_changes'").fetchone():
+        moves = conn.execute(
+            "SELECT old_niche, new_niche FROM archive_changes WHERE lead_id IS NULL ORDER BY id"
+        ).fetchall()
+        for old, new in moves:
+            conn.execute("UPDATE archived_leads SET niche=? WHERE niche=?", (new, old))
+    # Phones that already came back as a new lead stay with that lead.
+    conn.execute(
+        """
+        DELETE FROM archived_leads WHERE EXISTS (
+            SELECT 1 FROM leads WHERE leads.niche=archived_leads.niche AND leads.phone=archived_leads.phone
+        )
+        """
+    )
+
+
+def _create_archive_changes(conn: sqlite3.Connection) -> None:
+    # Archive files are separate databases, so changes to them are queued here in the
+    # transaction that calls for them and made by apply_archive_changes() once it has
+    # committed. A change deletes lead_id from the file of month, or moves the leads of
+    # old_niche to new_niche in every file; either is safe to repeat.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS archive_changes (
+            id INTEGER PRIMARY KEY,
+            month TEXT,
+            lead_id INTEGER,
+            old_niche TEXT,
+            new_niche TEXT
         )
+        """
+    )
+
+
+def _m013_archive_changes(conn: sqlite3.Connection) -> None:
+    _create_archive_changes(conn)
+
+
+# Append only: a migration's position in this list is its schema version.
+MIGRATIONS = [
+    _m001_initial,
+    _m002_lead_indexes,
+    _m003_stats_rollups,
+    _m004_fsm_state,
+    _m005_niches,
+    _m006_resegment_checkpoints,
+    _m007_funnel,
+    _m008_lead_email_index,
+    _m009_lead_changes_index,
+    _m010_lead_niche_created_index,
+    _m011_stable_niche_id,
+    _m012_archived_leads,
+    _m013_archive_changes,
+]
+# cli stats reads databases at this version without migrating them.
+if len(MIGRATIONS) != queries.SCHEMA_VERSION:
+    raise RuntimeError(
+        f"queries.SCHEMA_VERSION is {queries.SCHEMA_VERSION} but there are "
+        f"{len(MIGRATIONS)} migrations; update it"
+    )
+
+
+NICHE_TABLES = ("leads", "lead_rollups", "outbox", "resegment_checkpoints", "funnel_events", "funnel_rollups")
+_ROLLUP_KEY = "day, niche, status, budget_key, timeframe_key, region"
+
+
+async def rename_niche(old: str, new: str) -> int:
+    """Move every stored row of niche ``old``, archives included, to ``new``; returns the
+    number of leads moved. Refused if ``new`` already has data."""
+    moved = await get_engine().write(_rename_niche, old, new)
+    await asyncio.to_thread(apply_archive_changes)
+    return moved
+
+
+def _niche_has_data(conn: sqlite3.Connection, niche_id: str) -> bool:
+    return any(
+        conn.execute(f"SELECT 1 FROM {table} WHERE niche=? LIMIT 1", (niche_id,)).fetchone()
+        for table in NICHE_TABLES
+    )
+
+
+def _rename_niche(conn: sqlite3.Connection, old: str, new: str) -> int:
+    if _niche_has_data(conn, new):
+        raise ValueError(f"Niche {new!r} already has data")
+    # The rollup triggers move the counts of live leads; what is left under the old id
+    # belongs to archived leads and is merged in.
+    moved = conn.execute("UPDATE leads SET niche=? WHERE niche=?", (new, old)).rowcount
+    conn.execute(
+        f"""
+        INSERT INTO lead_rollups ({_ROLLUP_KEY}, count)
+        SELECT day, ?, status, budget_key, timeframe_key, region, count
+        FROM lead_rollups WHERE niche=?
+        ON CONFLICT ({_ROLLUP_KEY}) DO UPDATE SET count=count+excluded.count
+        """,
+        (new, old),
+    )
+    conn.execute("DELETE FROM lead_rollups WHERE niche=?", (old,))
+    for table in NICHE_TABLES[2:]:
+        conn.execute(f"UPDATE {table} SET niche=? WHERE niche=?", (new, old))
+    # Not there yet when m011 runs this on a database older than m012.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='archived_leads'").fetchone():
+        conn.execute("UPDATE archived_leads SET niche=? WHERE niche=?", (new, old))
+    # Nor archive_changes before m013.
+    _create_archive_changes(conn)
+    conn.execute("INSERT INTO archive_changes (old_niche, new_niche) VALUES (?,?)", (old, new))
+    if moved:
+        logging.info("Moved %s leads from niche %r to %r", moved, old, new)
+    return moved
+
 
+def apply_archive_changes() -> None:
+    """Run the committed archive_changes in order, each removed once it is done. Blocking;
+    async code calls it through asyncio.to_thread."""
+    engine = get_engine()
+    for change in engine.submit_read(_read_archive_changes).result():
+        if change["lead_id"] is not None:
+            statement, params = "DELETE FROM leads WHERE id=?", [change["lead_id"]]
+        else:
+            statement, params = "UPDATE leads SET niche=? WHERE niche=?", [change["new_niche"], change["old_niche"]]
+        archive.update_files(archive_dir(), change["month"], statement, params)
+        engine.submit_write(_drop_archive_change, change["id"]).result()
 
-def save_lead(lead: dict[str, Any]) -> tuple[int, bool]:
-    with get_conn() as conn:
+
+def _read_archive_changes(conn: sqlite3.Connection) -> list[sqlite3.Row]:
+    return conn.execute("SELECT * FROM archive_changes ORDER BY id").fetchall()
+
+
+def _drop_archive_change(conn: sqlite3.Connection, change_id: int) -> None:
+    conn.execute("DELETE FROM archive_changes WHERE id=?", (change_id,))
+
+
+class PermanentDeliveryError(Exception):
+    """Delivery failed in a way that retrying will not fix (e.g. HTTP 4xx)."""
+
+
+# Kept as a module constant so the connection's statement cache reuses the prepared statement.
+# A new lead's id is normally picked by SQLite (the highest id + 1); when the newest leads
+# were archived it goes past their ids instead, so ids are never reused.
+_UPSERT_LEAD_SQL = """
+    INSERT INTO leads (
+        id, niche, name, phone, email, budget_key, budget_label, region,
+        timeframe_key, timeframe_label, contacted_before, status, raw_payload
+    ) VALUES (
+        (SELECT MAX(id) + 1 FROM archived_leads WHERE id > (SELECT IFNULL(MAX(id), 0) FROM leads)),
+        ?,?,?,?,?,?,?,?,?,?,?,?
+    )
+    ON CONFLICT(niche, phone) DO UPDATE SET
+        updated_at=CURRENT_TIMESTAMP,
+        name=excluded.name,
+        email=excluded.email,
+        budget_key=excluded.budget_key,
+        budget_label=excluded.budget_label,
+        region=excluded.region,
+        timeframe_key=excluded.timeframe_key,
+        timeframe_label=excluded.timeframe_label,
+        contacted_before=excluded.contacted_before,
+        status=excluded.status,
+        duplicate_count=duplicate_count+1,
+        raw_payload=excluded.raw_payload
+    RETURNING id, duplicate_count
+"""
+
+# Updates a returning user's lead found by id; the phone may be new (recognised by email),
+# unless another lead of the niche, stored or archived, already has it.
+_UPDATE_LEAD_SQL = """
+    UPDATE leads SET
+        updated_at=CURRENT_TIMESTAMP,
+        name=?,
+        phone=?,
+        email=?,
+        budget_key=?,
+        budget_label=?,
+        region=?,
+        timeframe_key=?,
+        timeframe_label=?,
+        contacted_before=?,
+        status=?,
+        duplicate_count=duplicate_count+1,
+        raw_payload=?
+    WHERE id=? AND niche=? AND NOT EXISTS (
+        SELECT 1 FROM leads AS other
+        WHERE other.niche=leads.niche AND other.phone=? AND other.id<>leads.id
+        UNION ALL
+        SELECT 1 FROM archived_leads
+        WHERE archived_leads.niche=leads.niche AND archived_leads.phone=?
+    )
+    RETURNING id, duplicate_count
+"""
+
+
+async def save_lead(
+    niche: NicheSettings, lead: dict[str, Any], update_of: int | None = None
+) -> tuple[int, bool]:
+    """Insert the lead, or update the one with the same phone; returns (id, is_duplicate).
+
+    ``update_of`` is the id of the stored lead a returning user was recognised as. That
+    lead is updated even if the phone changed; if it is gone, or the new phone belongs to
+    another lead, the phone decides as usual. An archived lead found either way is moved
+    back from its archive file and updated like a stored one.
+    """
+    started = time.perf_counter()
+    lead_id, is_duplicate, restored = await get_engine().write(_save_lead, niche, lead, update_of)
+    if restored:
         try:
-            cur = conn.execute(
-                """
-                INSERT INTO leads (
-                    name, phone, email, budget_key, budget_label, region,
-                    timeframe_key, timeframe_label, contacted_before, status, raw_payload
-                ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
-                """,
-                (
-                    lead.get("name"),
-                    lead.get("phone"),
-                    lead.get("email"),
-                    lead.get("budget_key"),
-                    lead.get("budget_label"),
-                    lead.get("region"),
-                    lead.get("timeframe_key"),
-                    lead.get("timeframe_label"),
-                    lead.get("contacted_before"),
-                    lead.get("status"),
-                    json.dumps(lead, ensure_ascii=False),
-                ),
-            )
-            return int(cur.lastrowid), False
-        except sqlite3.IntegrityError:
-            conn.execute(
-                """
-                UPDATE leads
-                SET updated_at=CURRENT_TIMESTAMP,
-                    name=?,
-                    email=?,
-                    budget_key=?,
-                    budget_label=?,
-                    region=?,
-                    timeframe_key=?,
-                    timeframe_label=?,
-                    contacted_before=?,
-                    status=?,
-                    duplicate_count=duplicate_count+1,
-                    raw_payload=?
-                WHERE phone=?
-                """,
-                (
-                    lead.get("name"),
-                    lead.get("email"),
-                    lead.get("budget_key"),
-                    lead.get("budget_label"),
-                    lead.get("region"),
-                    lead.get("timeframe_key"),
-                    lead.get("timeframe_label"),
-                    lead.get("contacted_before"),
-                    lead.get("status"),
-                    json.dumps(lead, ensure_ascii=False),
-                    lead.get("phone"),
-                ),
-            )
-            row = conn.execute("SELECT id FROM leads WHERE phone=?", (lead.get("phone"),)).fetchone()
-            return int(row["id"]) if row else 0, True
+            await asyncio.to_thread(apply_archive_changes)
+        except Exception:
+            # The lead is saved; the changes stay queued and are retried by the next run.
+            logging.exception("Could not update archive files after restoring lead %s", lead_id)
+    metrics.SAVE_LEAD_SECONDS.observe(time.perf_counter() - started)
+    metrics.LEADS_SAVED.inc(niche.niche_id, "true" if is_duplicate else "false")
+    return lead_id, is_duplicate
+
+
+def _save_lead(
+    conn: sqlite3.Connection, niche: NicheSettings, lead: dict[str, Any], update_of: int | None
+) -> tuple[int, bool, bool]:
+    values = (
+        lead.get("name"),
+        lead.get("phone"),
+        lead.get("email"),
+        lead.get("budget_key"),
+        lead.get("budget_label"),
+        lead.get("region"),
+        lead.get("timeframe_key"),
+        lead.get("timeframe_label"),
+        lead.get("contacted_before"),
+        lead.get("status"),
+        json.dumps(lead, ensure_ascii=False),
+    )
+    phone = lead.get("phone")
+    restored = False
+    if update_of is not None:
+        restored = _restore_archived(conn, niche.niche_id, "id", update_of)
+        row = conn.execute(_UPDATE_LEAD_SQL, (*values, update_of, niche.niche_id, phone, phone)).fetchone()
+        if row is not None:
+            return int(row["id"]), True, restored
+    restored = _restore_archived(conn, niche.niche_id, "phone", phone) or restored
+    row = conn.execute(_UPSERT_LEAD_SQL, (niche.niche_id, *values)).fetchone()
+    lead_id = int(row["id"])
+    is_duplicate = row["duplicate_count"] > 0
+    if not is_duplicate:
+        _enqueue_integrations(conn, niche, lead_id, lead)
+    return lead_id, is_duplicate, restored
+
+
+def _restore_archived(conn: sqlite3.Connection, niche_id: str, column: str, value: Any) -> bool:
+    """Move the archived lead with ``column`` = ``value`` back to leads under its old id;
+    True if its archive row is now queued for deletion (see apply_archive_changes)."""
+    tombstone = conn.execute(
+        f"SELECT id, month, phone FROM archived_leads WHERE niche=? AND {column}=?", (niche_id, value)
+    ).fetchone()
+    if tombstone is None:
+        return False
+    lead_id, month, phone = tombstone
+    # A stored lead took the phone over (possible before UPDATE checked archived_leads);
+    # that one is the lead for the phone now, and this one stays archived.
+    if conn.execute("SELECT 1 FROM leads WHERE niche=? AND phone=?", (niche_id, phone)).fetchone():
+        return False
+    conn.execute("DELETE FROM archived_leads WHERE id=?", (lead_id,))
+    row = archive.read_lead(archive_dir(), month, lead_id)
+    if row is None:
+        return False
+    raw_payload = json.dumps(archive.lead_payload(row), ensure_ascii=False)
+    conn.execute(
+        f"INSERT INTO leads ({', '.join(archive.LEAD_COLUMNS)}, raw_payload) "
+        f"VALUES ({','.join('?' * (len(archive.LEAD_COLUMNS) + 1))})",
+        (*(row[column] for column in archive.LEAD_COLUMNS), raw_payload),
+    )
+    # lead_rollups kept counting the lead while it was archived; the insert trigger has
+    # just counted it a second time.
+    conn.execute(
+        f"""
+        UPDATE lead_rollups SET count=count-1
+        WHERE ({_ROLLUP_KEY}) = (
+            SELECT date(created_at), niche, COALESCE(status, ''), COALESCE(budget_key, ''),
+                COALESCE(timeframe_key, ''), COALESCE(region, '')
+            FROM leads WHERE id=?
+        )
+        """,
+        (lead_id,),
+    )
+    conn.execute("INSERT INTO archive_changes (month, lead_id) VALUES (?,?)", (month, lead_id))
+    return True
 
 
-def stats() -> dict[str, int]:
-    with get_conn() as conn:
-        total = conn.execute("SELECT COUNT(*) AS c FROM leads").fetchone()["c"]
-        hot = conn.execute("SELECT COUNT(*) AS c FROM leads WHERE status='hot'").fetchone()["c"]
-        warm = conn.execute("SELECT COUNT(*) AS c FROM leads WHERE status='warm'").fetchone()["c"]
-        cold = conn.execute("SELECT COUNT(*) AS c FROM leads WHERE status='cold'").fetchone()["c"]
-    return {"total": total, "hot": hot, "warm": warm, "cold": cold}
+async def find_lead(
+    niche_id: str, phone: str | None = None, email: str | None = None
+) -> dict[str, Any] | None:
+    """The stored lead with ``phone``, or the latest one with ``email``, as saved (its raw
+    payload) plus ``id``; None if there is none. Archived leads are found too, after the
+    stored ones."""
+    return await get_engine().read(_find_lead, niche_id, phone, email)
 
 
-def export_leads_csv(start: date, end: date, output_path: Path) -> Path:
-    with get_conn() as conn:
-        rows = conn.execute(
+def _find_lead(
+    conn: sqlite3.Connection, niche_id: str, phone: str | None, email: str | None
+) -> dict[str, Any] | None:
+    if phone:
+        row = conn.execute(
+            "SELECT id, raw_payload FROM leads WHERE niche=? AND phone=?", (niche_id, phone)
+        ).fetchone()
+    elif email:
+        row = conn.execute(
             """
-            SELECT created_at, name, phone, email, budget_label, region, timeframe_label, status
-            FROM leads
-            WHERE date(created_at) BETWEEN date(?) AND date(?)
-            ORDER BY created_at ASC
+            SELECT id, raw_payload FROM leads
+            WHERE niche=? AND email=? COLLATE NOCASE
+            ORDER BY updated_at DESC, id DESC
+            LIMIT 1
             """,
-            (start.isoformat(), end.isoformat()),
-        ).fetchall()
+            (niche_id, email.strip()),
+        ).fetchone()
+    else:
+        return None
+    if row is not None:
+        return {**json.loads(row["raw_payload"] or "{}"), "id": row["id"]}
+    condition, value = ("phone=?", phone) if phone else ("email=? COLLATE NOCASE", email.strip())
+    tombstone = conn.execute(
+        f"""
+        SELECT id, month FROM archived_leads
+        WHERE niche=? AND {condition}
+        ORDER BY id DESC
+        LIMIT 1
+        """,
+        (niche_id, value),
+    ).fetchone()
+    if tombstone is None:
+        return None
+    row = archive.read_lead(archive_dir(), tombstone["month"], tombstone["id"])
+    if row is None:
+        return None
+    return {**archive.lead_payload(row), "id": row["id"]}
 
-    headers = [
-        "created_at",
-        "name",
-        "phone",
-        "email",
-        "budget",
-        "region",
-        "timeframe",
-        "status",
-    ]
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    with output_path.open("w", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file)
-        writer.writerow(headers)
-        for row in rows:
-            writer.writerow(
-                [
-                    row["created_at"],
-                    row["name"],
-                    row["phone"],
-                    row["email"],
-                    row["budget_label"],
-                    row["region"],
-                    row["timeframe_label"],
-                    row["status"],
-                ]
-            )
+async def stats(
+    niche_id: str | None,
+    start: date | None = None,
+    end: date | None = None,
+    dimension: str | None = None,
+) -> dict[str, Any]:
+    """See queries.stats."""
+    return await get_engine().read(queries.stats, niche_id, start, end, dimension)
+
+
+async def save_funnel_events(events: list[tuple[int, str, int, str, int]]) -> None:
+    """Append (ts, niche, user_id, step, event) rows and add them to funnel_rollups."""
+    await get_engine().write(_save_funnel_events, events)
+
+
+def _save_funnel_events(conn: sqlite3.Connection, events: list[tuple[int, str, int, str, int]]) -> None:
+    conn.executemany(
+        "INSERT INTO funnel_events (ts, niche, user_id, step, event) VALUES (?,?,?,?,?)", events
+    )
+    # Aggregated here rather than by a trigger: one upsert per key instead of one per event.
+    counts: dict[tuple[str, str, str, int], int] = {}
+    for ts, niche_id, _, step, event in events:
+        key = (time.strftime("%Y-%m-%d", time.gmtime(ts)), niche_id, step, event)
+        counts[key] = counts.get(key, 0) + 1
+    conn.executemany(
+        """
+        INSERT INTO funnel_rollups (day, niche, step, event, count) VALUES (?,?,?,?,?)
+        ON CONFLICT (niche, day, step, event) DO UPDATE SET count=count+excluded.count
+        """,
+        [(*key, count) for key, count in counts.items()],
+    )
+
+
+async def funnel_rollups(
+    niche_id: str, start: date | None = None, end: date | None = None
+) -> dict[str, dict[int, int]]:
+    """Event counts per step and event code from funnel_rollups."""
+    return await get_engine().read(_funnel_rollups, niche_id, start, end)
+
+
+def _funnel_rollups(
+    conn: sqlite3.Connection, niche_id: str, start: date | None, end: date | None
+) -> dict[str, dict[int, int]]:
+    rows = conn.execute(
+        """
+        SELECT step, event, SUM(count) AS c
+        FROM funnel_rollups
+        WHERE niche=? AND day BETWEEN ? AND ?
+        GROUP BY step, event
+        """,
+        (
+            niche_id,
+            start.isoformat() if start else "0000-00-00",
+            end.isoformat() if end else "9999-99-99",
+        ),
+    ).fetchall()
+    result: dict[str, dict[int, int]] = {}
+    for row in rows:
+        result.setdefault(row["step"], {})[row["event"]] = row["c"]
+    return result
+
+
+# (CSV header, leads column) pairs; the first header names are kept from the original export.
+EXPORT_COLUMNS = [
+    ("created_at", "created_at"),
+    ("name", "name"),
+    ("phone", "phone"),
+    ("email", "email"),
+    ("budget", "budget_label"),
+    ("region", "region"),
+    ("timeframe", "timeframe_label"),
+    ("status", "status"),
+    ("id", "id"),
+    ("updated_at", "updated_at"),
+    ("budget_key", "budget_key"),
+    ("timeframe_key", "timeframe_key"),
+    ("contacted_before", "contacted_before"),
+    ("duplicate_count", "duplicate_count"),
+    ("niche", "niche"),
+]
+
+
+async def export_leads_csv(
+    niche_id: str | None,
+    start: date,
+    end: date,
+    output_path: Path,
+    compression: str = "",
+) -> Path:
+    """Stream leads created between start and end (inclusive) to CSV, optionally gzip/zip.
+
+    ``niche_id=None`` exports every niche. Archive files of the months in the range are
+    read as well, merged with the live table by created_at.
+    """
+    return await get_engine().read(_export_leads_csv, niche_id, start, end, output_path, compression)
+
+
+def _export_leads_csv(
+    conn: sqlite3.Connection,
+    niche_id: str | None,
+    start: date,
+    end: date,
+    output_path: Path,
+    compression: str,
+) -> Path:
+    columns = ", ".join(column for _, column in EXPORT_COLUMNS)
+    # A plain range on created_at (no date() wrapper) lets idx_leads_created_at drive the scan.
+    where = "created_at >= ? AND created_at < ?"
+    params: list[Any] = [start.isoformat(), (end + timedelta(days=1)).isoformat()]
+    if niche_id is not None:
+        where += " AND niche=?"
+        params.append(niche_id)
+    query = f"SELECT {columns} FROM leads WHERE {where} ORDER BY created_at ASC"
+
+    archives = [connect(path, read_only=True) for path in archive.archive_files(archive_dir(), start, end)]
+    try:
+        cursors = [_iter_rows(db.execute(query, params)) for db in [*archives, conn]]
+        # created_at is the first column; every cursor is already sorted by it.
+        rows = heapq.merge(*cursors, key=lambda row: row[0]) if archives else cursors[0]
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with _open_export(output_path, compression) as file:
+            writer = csv.writer(file)
+            writer.writerow([header for header, _ in EXPORT_COLUMNS])
+            writer.writerows(rows)
+    finally:
+        for db in archives:
+            db.close()
 
     return output_path
 
 
-async def push_to_integrations(lead: dict[str, Any]) -> None:
-    payload = {
-        "niche": NICHE_NAME,
+def _iter_rows(cursor: sqlite3.Cursor) -> Iterator[sqlite3.Row]:
+    while True:
+        rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+@contextmanager
+def _open_export(output_path: Path, compression: str) -> Iterator[TextIO]:
+    if compression == "gzip":
+        with gzip.open(output_path, "wt", newline="", encoding="utf-8") as file:
+            yield file
+    elif compression == "zip":
+        member = output_path.stem if output_path.suffix == ".zip" else output_path.name
+        with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(member, "w", force_zip64=True) as raw:
+                with io.TextIOWrapper(raw, newline="", encoding="utf-8") as file:
+                    yield file
+    elif not compression:
+        with output_path.open("w", newline="", encoding="utf-8") as file:
+            yield file
+    else:
+        raise ValueError(f"Unknown export compression: {compression}")
+
+
+async def leads_changed_since(
+    niche_id: str | None,
+    after: tuple[str, int] | None,
+    limit: int,
+    settle_seconds: int = 0,
+) -> list[dict[str, Any]]:
+    """Up to ``limit`` leads ordered by (updated_at, id) that come after the key ``after``.
+
+    Leads changed in the last ``settle_seconds`` are left out: updated_at has a resolution
+    of one second, so a lead changed later in the same second as the last one returned
+    could otherwise sort before the caller's key and never be seen.
+    """
+    return await get_engine().read(_leads_changed_since, niche_id, after, limit, settle_seconds)
+
+
+def _leads_changed_since(
+    conn: sqlite3.Connection,
+    niche_id: str | None,
+    after: tuple[str, int] | None,
+    limit: int,
+    settle_seconds: int,
+) -> list[dict[str, Any]]:
+    where = "updated_at < datetime('now', ?)"
+    params: list[Any] = [f"-{settle_seconds} seconds"]
+    if after is not None:
+        where += " AND (updated_at, id) > (?, ?)"
+        params.extend(after)
+    if niche_id is not None:
+        where += " AND niche=?"
+        params.append(niche_id)
+    rows = conn.execute(
+        f"SELECT {', '.join(archive.LEAD_COLUMNS)} FROM leads WHERE {where} ORDER BY updated_at, id LIMIT ?",
+        [*params, limit],
+    )
+    return [dict(row) for row in rows]
+
+
+async def archive_leads(before: date, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move leads created before ``before`` (UTC) to the monthly archive files; returns how
+    many were moved.
+
+    Leads with deliveries still pending stay until they are delivered. lead_rollups is
+    not touched, so stats keep counting archived leads, and archived_leads keeps their
+    ids and contacts. Each batch is written to its archive file before it is deleted
+    here; at the end the freed pages are returned to the file system (incremental vacuum).
+    """
+    # A pending delete must not hit an archive row that is about to be written again.
+    await asyncio.to_thread(apply_archive_changes)
+    moved = 0
+    while True:
+        count = await get_engine().write(_archive_batch, archive_dir(), before.isoformat(), batch_size)
+        if not count:
+            break
+        moved += count
+    if moved and await auto_vacuum_enabled():
+        await asyncio.to_thread(_incremental_vacuum)
+    return moved
+
+
+def _archive_batch(conn: sqlite3.Connection, directory: Path, before: str, limit: int) -> int:
+    rows = conn.execute(
+        """
+        SELECT * FROM leads
+        WHERE created_at < ?
+            AND NOT EXISTS (
+                SELECT 1 FROM outbox WHERE outbox.lead_id=leads.id AND outbox.status='pending'
+            )
+        ORDER BY created_at
+        LIMIT ?
+        """,
+        (before, limit),
+    ).fetchall()
+    if not rows:
+        return 0
+    archive.write_leads(directory, rows)
+    conn.executemany(
+        "INSERT OR REPLACE INTO archived_leads (id, niche, phone, email, month) VALUES (?,?,?,?,?)",
+        [(row["id"], row["niche"], row["phone"], row["email"], row["created_at"][:7]) for row in rows],
+    )
+    conn.executemany("DELETE FROM leads WHERE id=?", [(row["id"],) for row in rows])
+    # A restored lead archived again before its old archive row was deleted: the row was
+    # just rewritten and has to stay.
+    conn.executemany("DELETE FROM archive_changes WHERE lead_id=?", [(row["id"],) for row in rows])
+    return len(rows)
+
+
+def _incremental_vacuum() -> None:
+    # Each step of the statement frees one page. execute() steps a statement without
+    # result columns only once, executescript() runs it to the end but commits first,
+    # hence a connection of its own rather than a write job.
+    conn = connect(DB_PATH, synchronous=DB_SYNCHRONOUS)
+    try:
+        conn.executescript("PRAGMA incremental_vacuum")
+    finally:
+        conn.close()
+
+
+async def auto_vacuum_enabled() -> bool:
+    """False for database files created before incremental vacuum; vacuum() converts them."""
+    return await get_engine().read(_auto_vacuum_enabled)
+
+
+def _auto_vacuum_enabled(conn: sqlite3.Connection) -> bool:
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+StatusTable = dict[tuple[Any, Any], str]
+# Rows per UPDATE ... FROM (VALUES ...) statement, two bound parameters each.
+RESEGMENT_UPDATE_ROWS = 500
+
+
+async def resegment_checkpoint(niche_id: str, rules: str) -> tuple[int, int]:
+    """(last processed lead id, leads changed so far) of an unfinished run with these rules."""
+    return await get_engine().read(_resegment_checkpoint, niche_id, rules)
+
+
+def _resegment_checkpoint(conn: sqlite3.Connection, niche_id: str, rules: str) -> tuple[int, int]:
+    row = conn.execute(
+        "SELECT last_id, changed FROM resegment_checkpoints WHERE niche=? AND rules=?",
+        (niche_id, rules),
+    ).fetchone()
+    return (row["last_id"], row["changed"]) if row else (0, 0)
+
+
+async def clear_resegment_checkpoints(niche_id: str) -> None:
+    await get_engine().write(_clear_resegment_checkpoints, niche_id)
+
+
+def _clear_resegment_checkpoints(conn: sqlite3.Connection, niche_id: str) -> None:
+    conn.execute("DELETE FROM resegment_checkpoints WHERE niche=?", (niche_id,))
+
+
+async def resegment_chunk(
+    niche: NicheSettings,
+    table: StatusTable,
+    rules: str,
+    after_id: int,
+    limit: int,
+    dry_run: bool = False,
+    push_crm: bool = False,
+) -> tuple[int | None, dict[tuple[str, str], int]]:
+    """Re-segment up to ``limit`` leads with id > ``after_id``.
+
+    Returns the last id seen (None when no leads are left) and counts of
+    (old status, new status) transitions. Unless ``dry_run``, the changes, the CRM outbox
+    rows for changed leads (``push_crm``) and the checkpoint are committed together, so an
+    interrupted run resumes exactly after the last committed chunk.
+    """
+    engine = get_engine()
+    if dry_run:
+        return await engine.read(_resegment_chunk, niche, table, rules, after_id, limit, True, False)
+    return await engine.write(_resegment_chunk, niche, table, rules, after_id, limit, False, push_crm)
+
+
+def _resegment_chunk(
+    conn: sqlite3.Connection,
+    niche: NicheSettings,
+    table: StatusTable,
+    rules: str,
+    after_id: int,
+    limit: int,
+    dry_run: bool,
+    push_crm: bool,
+) -> tuple[int | None, dict[tuple[str, str], int]]:
+    # The status table goes in as a VALUES list, so the new statuses come out of SQL and
+    # only ids and statuses cross into Python. Keys the rules do not know are segmented
+    # like a missing answer (NULL).
+    rule_values = [value for key, status in table.items() for value in (*key, status)]
+    rows = conn.execute(
+        f"""
+        WITH rules (budget_key, timeframe_key, status) AS (
+            VALUES {",".join(["(?,?,?)"] * len(table))}
+        ),
+        chunk AS (
+            SELECT id, status, budget_key, timeframe_key FROM leads
+            WHERE niche=? AND id>?
+            ORDER BY id
+            LIMIT ?
+        )
+        SELECT chunk.id, chunk.status, rules.status AS new_status
+        FROM chunk JOIN rules
+            ON rules.budget_key IS (
+                CASE WHEN chunk.budget_key IN (SELECT budget_key FROM rules) THEN chunk.budget_key END
+            )
+            AND rules.timeframe_key IS (
+                CASE WHEN chunk.timeframe_key IN (SELECT timeframe_key FROM rules) THEN chunk.timeframe_key END
+            )
+        ORDER BY chunk.id
+        """,
+        (*rule_values, niche.niche_id, after_id, limit),
+    ).fetchall()
+    if not rows:
+        return None, {}
+
+    diff: dict[tuple[str, str], int] = {}
+    changed = []
+    for lead_id, old_status, status in rows:
+        if status != old_status:
+            transition = (old_status, status)
+            diff[transition] = diff.get(transition, 0) + 1
+            changed.append((lead_id, status))
+
+    last_id = rows[-1]["id"]
+    if dry_run:
+        return last_id, diff
+
+    for start in range(0, len(changed), RESEGMENT_UPDATE_ROWS):
+        batch = changed[start : start + RESEGMENT_UPDATE_ROWS]
+        conn.execute(
+            f"""
+            UPDATE leads SET status=changes.column2, updated_at=CURRENT_TIMESTAMP
+            FROM (VALUES {",".join(["(?,?)"] * len(batch))}) AS changes
+            WHERE leads.id=changes.column1
+            """,
+            [value for change in batch for value in change],
+        )
+    if push_crm and niche.crm_webhook_url and changed:
+        outbox_rows = []
+        for start in range(0, len(changed), RESEGMENT_UPDATE_ROWS):
+            batch = [lead_id for lead_id, _ in changed[start : start + RESEGMENT_UPDATE_ROWS]]
+            leads = conn.execute(
+                f"""
+                SELECT id, created_at, name, phone, email, budget_key, budget_label, region,
+                    timeframe_key, timeframe_label, contacted_before, status
+                FROM leads WHERE id IN ({",".join("?" * len(batch))})
+                """,
+                batch,
+            )
+            for lead in leads:
+                payload = json.dumps(build_payload(niche, dict(lead)), ensure_ascii=False)
+                outbox_rows.append((niche.niche_id, lead["id"], "crm", payload))
+        conn.executemany(
+            "INSERT INTO outbox (niche, lead_id, sink, payload) VALUES (?,?,?,?)", outbox_rows
+        )
+    conn.execute(
+        """
+        INSERT INTO resegment_checkpoints (niche, rules, last_id, changed) VALUES (?,?,?,?)
+        ON CONFLICT(niche, rules) DO UPDATE SET
+            last_id=excluded.last_id,
+            changed=changed+excluded.changed,
+            updated_at=CURRENT_TIMESTAMP
+        """,
+        (niche.niche_id, rules, last_id, len(changed)),
+    )
+    return last_id, diff
+
+
+def build_payload(niche: NicheSettings, lead: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "niche": niche.niche_name,
         "created_at": lead.get("created_at"),
         "name": lead.get("name"),
         "phone": lead.get("phone"),
@@ -177,74 +1118,259 @@ async def push_to_integrations(lead: dict[str, Any]) -> None:
         "status": lead.get("status"),
     }
 
-    await _post_webhook(CRM_WEBHOOK_URL, payload)
-    await _post_webhook(GOOGLE_SHEETS_WEBHOOK_URL, payload)
 
-    if GOOGLE_SHEETS_CSV_PATH:
-        _append_csv(Path(GOOGLE_SHEETS_CSV_PATH), payload)
+def configured_sinks(niche: NicheSettings) -> list[str]:
+    sinks = []
+    if niche.crm_webhook_url:
+        sinks.append("crm")
+    if niche.google_sheets_webhook_url:
+        sinks.append("sheets")
+    if niche.google_sheets_csv_path:
+        sinks.append("csv")
+    return sinks
 
 
-async def _post_webhook(url: str, payload: dict[str, Any]) -> None:
-    if not url:
-        return
-    try:
-        async with httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS) as client:
-            response = await client.post(url, json=payload)
-            if response.status_code >= 400:
-                logging.error(
-                    "Webhook push failed: %s status=%s body=%s",
-                    url,
-                    response.status_code,
-                    response.text[:500],
-                )
-    except Exception:
-        logging.exception("Webhook push failed: %s", url)
-
-
-def _append_csv(path: Path, payload: dict[str, Any]) -> None:
-    headers = [
-        "created_at",
-        "name",
-        "phone",
-        "email",
-        "budget",
-        "budget_key",
-        "region",
-        "timeframe",
-        "timeframe_key",
-        "contacted_before",
-        "status",
+def _enqueue_integrations(
+    conn: sqlite3.Connection, niche: NicheSettings, lead_id: int, lead: dict[str, Any]
+) -> None:
+    payload = json.dumps(build_payload(niche, lead), ensure_ascii=False)
+    conn.executemany(
+        "INSERT INTO outbox (niche, lead_id, sink, payload) VALUES (?,?,?,?)",
+        [(niche.niche_id, lead_id, sink, payload) for sink in configured_sinks(niche)],
+    )
+
+
+async def claim_outbox(
+    niche_ids: Iterable[str],
+    limit: int,
+    lease_seconds: float,
+    only_sink: str | None = None,
+    skip_sinks: Iterable[str] = (),
+) -> list[dict[str, Any]]:
+    return await get_engine().write(
+        _claim_outbox, list(niche_ids), limit, lease_seconds, only_sink, list(skip_sinks)
+    )
+
+
+def _claim_outbox(
+    conn: sqlite3.Connection,
+    niche_ids: list[str],
+    limit: int,
+    lease_seconds: float,
+    only_sink: str | None,
+    skip_sinks: list[str],
+) -> list[dict[str, Any]]:
+    """Lease due outbox rows so a crashed dispatcher's work is picked up again later."""
+    now = time.time()
+    where = f"status='pending' AND next_attempt_at<=? AND niche IN ({','.join('?' * len(niche_ids))})"
+    params: list[Any] = [now + lease_seconds, now, *niche_ids]
+    if only_sink:
+        where += " AND sink=?"
+        params.append(only_sink)
+    if skip_sinks:
+        where += f" AND sink NOT IN ({','.join('?' * len(skip_sinks))})"
+        params.extend(skip_sinks)
+    params.append(limit)
+
+    rows = conn.execute(
+        f"""
+        UPDATE outbox
+        SET attempts=attempts+1, next_attempt_at=?
+        WHERE id IN (
+            SELECT id FROM outbox
+            WHERE {where}
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+        )
+        RETURNING id, niche, lead_id, sink, payload, attempts
+        """,
+        params,
+    ).fetchall()
+    return [
+        {
+            "id": row["id"],
+            "niche": row["niche"],
+            "lead_id": row["lead_id"],
+            "sink": row["sink"],
+            "payload": json.loads(row["payload"]),
+            "attempts": row["attempts"],
+        }
+        for row in rows
     ]
 
-    path.parent.mkdir(parents=True, exist_ok=True)
-    write_header = not path.exists()
-    with path.open("a", newline="", encoding="utf-8") as file:
-        writer = csv.DictWriter(file, fieldnames=headers)
-        if write_header:
-            writer.writeheader()
-        writer.writerow(
-            {
-                "created_at": payload.get("created_at"),
-                "name": payload.get("name"),
-                "phone": payload.get("phone"),
-                "email": payload.get("email"),
-                "budget": payload.get("budget"),
-                "budget_key": payload.get("budget_key"),
-                "region": payload.get("region"),
-                "timeframe": payload.get("timeframe"),
-                "timeframe_key": payload.get("timeframe_key"),
-                "contacted_before": payload.get("contacted_before"),
-                "status": payload.get("status"),
-            }
+
+async def outbox_batch_ready(
+    niche_ids: Iterable[str], sink: str, size: int, window_seconds: float
+) -> bool:
+    return await get_engine().read(_outbox_batch_ready, list(niche_ids), sink, size, window_seconds)
+
+
+def _outbox_batch_ready(
+    conn: sqlite3.Connection, niche_ids: list[str], sink: str, size: int, window_seconds: float
+) -> bool:
+    """A batch is due once it is full or its oldest row has waited for the whole window."""
+    row = conn.execute(
+        f"""
+        SELECT COUNT(*) AS c, MIN(created_at) <= datetime('now', ?) AS expired
+        FROM outbox
+        WHERE status='pending' AND sink=? AND next_attempt_at<=?
+            AND niche IN ({','.join('?' * len(niche_ids))})
+        """,
+        (f"-{int(window_seconds)} seconds", sink, time.time(), *niche_ids),
+    ).fetchone()
+    return row["c"] >= size or bool(row["expired"])
+
+
+async def complete_outbox(outbox_ids: list[int]) -> None:
+    await get_engine().write(_complete_outbox, outbox_ids)
+
+
+def _complete_outbox(conn: sqlite3.Connection, outbox_ids: list[int]) -> None:
+    conn.executemany("DELETE FROM outbox WHERE id=?", [(outbox_id,) for outbox_id in outbox_ids])
+
+
+async def fail_outbox(outbox_id: int, attempts: int, error: str, permanent: bool = False) -> bool:
+    """Schedule a retry with exponential backoff. Returns True if the row was dead-lettered."""
+    dead = permanent or attempts >= OUTBOX_MAX_ATTEMPTS
+    if dead:
+        next_attempt_at = None
+    else:
+        delay = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+        next_attempt_at = time.time() + delay * random.uniform(0.8, 1.2)
+    await get_engine().write(_fail_outbox, outbox_id, error[:1000], next_attempt_at)
+    return dead
+
+
+def _fail_outbox(
+    conn: sqlite3.Connection, outbox_id: int, error: str, next_attempt_at: float | None
+) -> None:
+    if next_attempt_at is None:
+        conn.execute("UPDATE outbox SET status='dead', last_error=? WHERE id=?", (error, outbox_id))
+    else:
+        conn.execute(
+            "UPDATE outbox SET next_attempt_at=?, last_error=? WHERE id=?",
+            (next_attempt_at, error, outbox_id),
         )
 
 
-@contextmanager
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+async def replay_dead_outbox(niche_id: str | None = None, sink: str | None = None) -> int:
+    """Give dead-lettered deliveries a fresh set of attempts. Returns the number of rows."""
+    return await get_engine().write(_replay_dead_outbox, niche_id, sink)
+
+
+def _replay_dead_outbox(conn: sqlite3.Connection, niche_id: str | None, sink: str | None) -> int:
+    where = "status='dead'"
+    params: list[Any] = []
+    if niche_id is not None:
+        where += " AND niche=?"
+        params.append(niche_id)
+    if sink is not None:
+        where += " AND sink=?"
+        params.append(sink)
+    return conn.execute(
+        f"UPDATE outbox SET status='pending', attempts=0, next_attempt_at=0 WHERE {where}",
+        params,
+    ).rowcount
+
+
+def vacuum() -> tuple[int, int]:
+    """Rebuild the database file and refresh planner statistics; returns the size before
+    and after. Runs on its own connection, so call it while the engine is closed."""
+    size_before = _db_size()
+    conn = connect(DB_PATH, synchronous=DB_SYNCHRONOUS)
     try:
-        yield conn
-        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA optimize")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
     finally:
         conn.close()
+    return size_before, _db_size()
+
+
+def _db_size() -> int:
+    return sum(
+        path.stat().st_size
+        for path in (DB_PATH, DB_PATH.with_name(DB_PATH.name + "-wal"))
+        if path.exists()
+    )
+
+
+def start_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is not None:
+        return _http_client
+
+    import httpx
+
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logging.warning("HTTP2_ENABLED=1 but the 'h2' package is missing, using HTTP/1.1")
+            http2 = False
+
+    _http_client = httpx.AsyncClient(
+        timeout=WEBHOOK_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        http2=http2,
+    )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is None:
+        return
+    client, _http_client = _http_client, None
+    await client.aclose()
+
+
+async def deliver(niche: NicheSettings, sink: str, payload: dict[str, Any]) -> None:
+    if sink == "crm":
+        await _post_webhook("crm", niche.crm_webhook_url, payload, CRM_TIMEOUT_SECONDS)
+    elif sink == "sheets":
+        await _post_webhook("sheets", niche.google_sheets_webhook_url, payload, GOOGLE_SHEETS_TIMEOUT_SECONDS)
+    elif sink == "csv":
+        if niche.google_sheets_csv_path:
+            await csv_sink.get_sink(Path(niche.google_sheets_csv_path)).append(payload)
+    else:
+        raise PermanentDeliveryError(f"Unknown sink: {sink}")
+
+
+async def deliver_batch(niche: NicheSettings, sink: str, payloads: list[dict[str, Any]]) -> None:
+    if sink != "sheets":
+        raise PermanentDeliveryError(f"Sink does not support batches: {sink}")
+    await _post_webhook("sheets", niche.google_sheets_webhook_url, payloads, GOOGLE_SHEETS_TIMEOUT_SECONDS)
+
+
+async def _post_webhook(sink: str, url: str, payload: Any, timeout: float) -> None:
+    if not url:
+        return
+    client = start_http_client()
+    import httpx  # already loaded by start_http_client
+
+    started = time.perf_counter()
+    try:
+        # wait_for also bounds the time spent waiting for a free pooled connection.
+        response = await asyncio.wait_for(client.post(url, json=payload, timeout=timeout), timeout)
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        metrics.WEBHOOK_RESPONSES.inc(sink, "timeout")
+        raise
+    except Exception:
+        metrics.WEBHOOK_RESPONSES.inc(sink, "error")
+        raise
+    finally:
+        metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - started, sink)
+    metrics.WEBHOOK_RESPONSES.inc(sink, response.status_code)
+    if response.status_code >= 400:
+        message = f"{url} status={response.status_code} body={response.text[:500]}"
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            raise PermanentDeliveryError(message)
+        raise RuntimeError(message)
+
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from app_logging import setup_logging
+from bot import create_bots
+from config import (
+    NicheSettings,
+    load_niches,
+    TELEGRAM_WEBHOOK_URL,
+    TELEGRAM_WEBHOOK_PATH,
+    TELEGRAM_WEBHOOK_SECRET,
+    TELEGRAM_WEBHOOK_HOST,
+    TELEGRAM_WEBHOOK_PORT,
+    TELEGRAM_WEBHOOK_MAX_CONCURRENCY,
+)
+from storage import init_db
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Acknowledges updates immediately and processes them in the background, holding a
+    slot of ``slots`` for each one.
+
+    The bots of all niches share one semaphore, so the process handles at most that many
+    updates at once. When all slots are busy the HTTP response is delayed, which makes
+    Telegram hold back further deliveries instead of piling up background tasks here.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, slots: asyncio.Semaphore, **kwargs: Any) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, **kwargs)
+        self.slots = slots
+        self._tasks: set[asyncio.Task] = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+        update = await request.json(loads=bot.session.json_loads)
+        await self.slots.acquire()
+        task = asyncio.create_task(self._process(bot, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await super().close()
+
+    async def _process(self, bot: Bot, update: dict[str, Any]) -> None:
+        try:
+            result = await self.dispatcher.feed_raw_update(bot, update, **self.data)
+            if isinstance(result, TelegramMethod):
+                await self.dispatcher.silent_call_request(bot=bot, result=result)
+        except Exception:
+            logging.exception("Failed to process webhook update")
+        finally:
+            self.slots.release()
+
+
+def webhook_path(bot: Bot, bots: list[Bot]) -> str:
+    # A single bot keeps the plain path; with several niches each bot gets its own suffix.
+    if len(bots) == 1:
+        return TELEGRAM_WEBHOOK_PATH
+    return f"{TELEGRAM_WEBHOOK_PATH.rstrip('/')}/{bot.id}"
+
+
+async def set_webhooks(bots: list[Bot], allowed_updates: list[str]) -> None:
+    if not TELEGRAM_WEBHOOK_URL:
+        # Handy for local runs: POST recorded Update JSON to the path by hand.
+        logging.warning("TELEGRAM_WEBHOOK_URL is empty, webhook is not registered with Telegram")
+        return
+    for bot in bots:
+        await bot.set_webhook(
+            TELEGRAM_WEBHOOK_URL.rstrip("/") + webhook_path(bot, bots),
+            secret_token=TELEGRAM_WEBHOOK_SECRET or None,
+            allowed_updates=allowed_updates,
+            max_connections=min(100, TELEGRAM_WEBHOOK_MAX_CONCURRENCY),
+        )
+
+
+def create_app(bots: list[Bot], dp: Dispatcher) -> web.Application:
+    app = web.Application()
+    slots = asyncio.Semaphore(TELEGRAM_WEBHOOK_MAX_CONCURRENCY)
+    for bot in bots:
+        BoundedRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            slots=slots,
+            secret_token=TELEGRAM_WEBHOOK_SECRET or None,
+        ).register(app, path=webhook_path(bot, bots))
+    setup_application(app, dp, bots=bots)
+    return app
+
+
+async def run_webhook(niches: list[NicheSettings] | None = None) -> None:
+    setup_logging()
+    init_db()
+    bots, dp = create_bots(niches or load_niches())
+    app = create_app(bots, dp)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, TELEGRAM_WEBHOOK_HOST, TELEGRAM_WEBHOOK_PORT)
+    await site.start()
+
+    try:
+        await set_webhooks(bots, dp.resolve_used_update_types())
+        logging.info(
+            "Lead bot started (webhook on %s:%s%s, %s niche(s))",
+            TELEGRAM_WEBHOOK_HOST,
+            TELEGRAM_WEBHOOK_PORT,
+            TELEGRAM_WEBHOOK_PATH,
+            len(bots),
+        )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()